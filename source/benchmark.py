@@ -0,0 +1,237 @@
+#!/usr/bin/python
+""" Benchmark suite for the thermal model.  Times the real models in ./data and synthetic networks of chosen
+size and topology built from the materials in ./materials, in object mode (Thermal.run_objects) and with the
+compiled network integrators, and writes the results as json so that runs from different versions can be
+compared.  Run from the repository root, eg.
+
+    python source/benchmark.py --output bench.json
+    python source/benchmark.py --compare old.json bench.json
+"""
+import sys
+import time
+import json
+import argparse
+import platform
+import tracemalloc
+import numpy as np
+from capacitor import Capacitor
+from conductor import Conductor
+from radiator import Radiator
+from cooler import Cooler
+from network import Network
+from integrator import Integrator
+from recorder import Recorder
+from loader import Loader
+from thermal import Thermal
+
+
+class Benchmark:
+
+    topologies = ['chain', 'tree', 'random']
+
+    def __init__(self, **kwargs):
+        self.run_time = kwargs.get('run_time', 3600.)        # Simulated time per case (s)
+        self.delta_time = kwargs.get('delta_time', 1.)
+        self.measure_memory = kwargs.get('measure_memory', True)
+        self.results = []
+        return
+
+    @staticmethod
+    def make_model(topology, n_nodes, n_edges, seed=0):
+        """ Generate a synthetic model with n_nodes capacitors (node 0 is a pt16_hp cooler, node 1 a heavy room
+        temperature 'world') joined by n_edges conductors, plus one radiator to the world for every tenth node.
+        'chain' and 'tree' have n_nodes - 1 conductors, 'random' adds random links to a spanning tree to make
+        up n_edges.  Materials are drawn from the 'Marvel' groups of materials/*.csv.
+        """
+        Capacitor.load_data()
+        Conductor.load_data()
+        rng = np.random.default_rng(seed)
+        cap_materials = [m for m, g in Capacitor.kint_groups.items() if g == 'Marvel']
+        con_materials = [m for m, g in Conductor.groups.items() if g == 'Marvel']
+
+        capacitors = [Cooler(('pt16_hp', 'Cu(OFHC)', '0.5', '295.', 'orange')),
+                      Capacitor(('world', 'Cu(OFHC)', '10000.', '295.', 'lightgrey'))]
+        for i in range(2, n_nodes):
+            params = ('node_{:d}'.format(i), str(rng.choice(cap_materials)), str(rng.uniform(0.05, 2.)),
+                      '295.', 'grey')
+            capacitors.append(Capacitor(params))
+
+        if topology == 'chain':
+            pairs = [(i, i + 1) for i in range(0, n_nodes - 1)]
+        else:
+            pairs = [(int(rng.integers(0, i)), i) for i in range(1, n_nodes)]
+            if topology == 'random':
+                while len(pairs) < n_edges:
+                    a, b = rng.integers(0, n_nodes, 2)
+                    if a != b:
+                        pairs.append((int(a), int(b)))
+        conductors = []
+        for i, (a, b) in enumerate(pairs):
+            params = ('con_{:d}'.format(i), str(rng.choice(con_materials)), str(rng.uniform(0.01, 0.2)),
+                      str(rng.uniform(1.0E-6, 1.0E-4)), 'black')
+            conductors.append(Conductor(params, [capacitors[a], capacitors[b]]))
+        radiators = []
+        for i in range(2, n_nodes, 10):
+            params = ('rad_{:d}'.format(i), str(rng.uniform(0.05, 0.2)), str(rng.uniform(0.01, 0.1)), 'red')
+            radiators.append(Radiator(params, [capacitors[1], capacitors[i]]))
+        return capacitors, conductors, radiators
+
+    def time_run(self, network, **kwargs):
+        """ Run a compiled network, returning a dictionary of timing (and optionally memory) figures. """
+        integrator = Integrator(network, **kwargs)
+        recorder = Recorder(network.names, network.con_names, network.rad_names,
+                            n_samples=int(self.run_time / self.delta_time) + 1)
+        t0 = time.perf_counter()
+        integrator.run(network.temperatures, self.run_time, self.delta_time, recorder)
+        wall_time = time.perf_counter() - t0
+        result = {'n_steps': integrator.n_steps, 'wall_time': wall_time,
+                  'ticks_per_second': integrator.n_steps / wall_time,
+                  'wall_time_per_hour': wall_time * 3600. / self.run_time}
+        if self.measure_memory:
+            tracemalloc.start()
+            integrator = Integrator(network, **kwargs)
+            recorder = Recorder(network.names, network.con_names, network.rad_names,
+                                n_samples=int(self.run_time / self.delta_time) + 1)
+            integrator.run(network.temperatures, self.run_time, self.delta_time, recorder)
+            result['peak_memory_mb'] = tracemalloc.get_traced_memory()[1] / 1.0E6
+            tracemalloc.stop()
+        return result
+
+    def time_objects(self, make_model):
+        """ Run the object loop (Thermal.run_objects) on the elements returned by make_model(), which is called
+        again for the memory measurement since a run changes the capacitor temperatures.
+        """
+        def run():
+            thermal = Thermal()
+            elements = make_model()
+            thermal.capacitors, thermal.conductors, thermal.radiators = elements[0:3]
+            thermal.enclosures = elements[3] if len(elements) > 3 else []
+            recorder = Recorder([cap.name for cap in thermal.capacitors],
+                                [con.from_to_name for con in thermal.conductors],
+                                [rad.from_to_name for rad in thermal.radiators],
+                                n_samples=int(self.run_time / self.delta_time) + 1)
+            t0 = time.perf_counter()
+            thermal.run_objects(self.run_time, self.delta_time, recorder)
+            return time.perf_counter() - t0
+
+        wall_time = run()
+        n_steps = len(np.arange(0., self.run_time, self.delta_time))
+        result = {'n_steps': n_steps, 'wall_time': wall_time, 'ticks_per_second': n_steps / wall_time,
+                  'wall_time_per_hour': wall_time * 3600. / self.run_time}
+        if self.measure_memory:
+            tracemalloc.start()
+            run()
+            result['peak_memory_mb'] = tracemalloc.get_traced_memory()[1] / 1.0E6
+            tracemalloc.stop()
+        return result
+
+    def run_model(self, model_name, settings):
+        """ Benchmark one of the models in ./data, including its startup time from csv and from the cache. """
+        t0 = time.perf_counter()
+        network = Network(*Loader.read_model(model_name))
+        startup = time.perf_counter() - t0
+        Loader.load_network(model_name)             # Make sure the compiled network is cached
+        t0 = time.perf_counter()
+        network = Loader.load_network(model_name)
+        cached_startup = time.perf_counter() - t0
+        for label, kwargs in settings:
+            result = {'case': model_name, 'settings': label, 'n_nodes': network.n_nodes,
+                      'n_edges': len(network.con_names) + len(network.rad_names),
+                      'startup_time': startup, 'cached_startup_time': cached_startup}
+            if kwargs.get('mode', 'network') == 'object':
+                result.update(self.time_objects(lambda: Loader.read_model(model_name)))
+            else:
+                result.update(self.time_run(network, **kwargs))
+            self.report(result)
+        return
+
+    def run_synthetic(self, topology, n_nodes, n_edges, settings):
+        t0 = time.perf_counter()
+        network = Network(*Benchmark.make_model(topology, n_nodes, n_edges))
+        startup = time.perf_counter() - t0
+        for label, kwargs in settings:
+            result = {'case': "{:s}_{:d}".format(topology, n_nodes), 'settings': label,
+                      'n_nodes': network.n_nodes, 'n_edges': len(network.con_names) + len(network.rad_names),
+                      'startup_time': startup}
+            if kwargs.get('mode', 'network') == 'object':
+                result.update(self.time_objects(lambda: Benchmark.make_model(topology, n_nodes, n_edges)))
+            else:
+                result.update(self.time_run(network, **kwargs))
+            self.report(result)
+        return
+
+    def report(self, result):
+        self.results.append(result)
+        text = "{:<14s} {:<20s} {:6d} nodes {:8.0f} ticks/s {:8.3f} s/sim hr".format(
+            result['case'], result['settings'], result['n_nodes'], result['ticks_per_second'],
+            result['wall_time_per_hour'])
+        if 'peak_memory_mb' in result:
+            text += " {:8.2f} MB".format(result['peak_memory_mb'])
+        print(text)
+        return
+
+    def write(self, path):
+        header = {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+                  'platform': platform.platform(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  'run_time': self.run_time, 'delta_time': self.delta_time}
+        with open(path, 'w') as text_file:
+            json.dump({'header': header, 'results': self.results}, text_file, indent=1)
+        return
+
+    @staticmethod
+    def compare(old_path, new_path, threshold=0.1):
+        """ Print the change in wall time per simulated hour of every case common to two result files and
+        return the cases which are slower by more than the fractional threshold.
+        """
+        tables = []
+        for path in [old_path, new_path]:
+            with open(path, 'r') as text_file:
+                results = json.load(text_file)['results']
+            tables.append({(r['case'], r['settings']): r for r in results})
+        regressions = []
+        for key in tables[1]:
+            if key not in tables[0]:
+                continue
+            old, new = tables[0][key]['wall_time_per_hour'], tables[1][key]['wall_time_per_hour']
+            change = (new - old) / old
+            flag = ' REGRESSION' if change > threshold else ''
+            print("{:<14s} {:<20s} {:8.3f} -> {:8.3f} s/sim hr ({:+.0%}){:s}".format(key[0], key[1], old, new,
+                                                                                    change, flag))
+            if change > threshold:
+                regressions.append(key)
+        return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the thermal model')
+    parser.add_argument('--output', default='bench_output.json', help='json results file')
+    parser.add_argument('--run-time', type=float, default=3600., help='simulated seconds per case')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help='synthetic node counts')
+    parser.add_argument('--no-memory', action='store_true', help='skip the peak memory measurement')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files')
+    args = parser.parse_args(argv)
+
+    if args.compare is not None:
+        regressions = Benchmark.compare(args.compare[0], args.compare[1])
+        return 1 if len(regressions) > 0 else 0
+
+    benchmark = Benchmark(run_time=args.run_time, measure_memory=not args.no_memory)
+    settings = [('object', {'mode': 'object'}),
+                ('euler', {'method': 'euler'}),
+                ('backward_euler_adapt', {'method': 'backward_euler', 'adaptive': True})]
+    for model_name in ['marvel', 'metis']:
+        benchmark.run_model(model_name, settings)
+    for n_nodes in args.sizes:
+        sparse_settings = [('object', {'mode': 'object'}),
+                           ('euler', {'method': 'euler'}),
+                           ('backward_euler_sparse', {'method': 'backward_euler', 'adaptive': True,
+                                                      'backend': 'sparse'})]
+        for topology in Benchmark.topologies:
+            benchmark.run_synthetic(topology, n_nodes, 2 * n_nodes, sparse_settings)
+    benchmark.write(args.output)
+    print('Results written to ' + args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
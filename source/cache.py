@@ -0,0 +1,77 @@
+#!/usr/bin/python
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """ Content addressed store of run results.  Each entry is an .npz file named by a hash of everything that
+    determines the result (model and material files, the model state at the start of the run and the solver
+    settings), so an identical run is read back instead of simulated.  The cache is bounded in size and number
+    of entries, evicting the least recently used; a hit refreshes the modification time of its file.
+    """
+
+    def __init__(self, path='./data/results/', **kwargs):
+        self.path = path
+        self.max_bytes = kwargs.get('max_bytes', 500.0E6)      # Total size of the stored results
+        self.max_entries = kwargs.get('max_entries', 200)
+        self.n_hits, self.n_misses = 0, 0
+        return
+
+    @staticmethod
+    def get_key(*parts):
+        """ Hash of json serialisable parts (eg file hashes and a settings dictionary). """
+        text = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def _get_path(self, key):
+        return os.path.join(self.path, key + '.npz')
+
+    def get(self, key):
+        """ Return the dictionary of arrays stored under key, or None. """
+        path = self._get_path(key)
+        try:
+            with np.load(path, allow_pickle=False) as arrays:
+                result = {name: arrays[name] for name in arrays.files}
+        except (OSError, ValueError):
+            self.n_misses += 1
+            return None
+        os.utime(path)
+        self.n_hits += 1
+        log.info('Result cache hit ' + key)
+        return result
+
+    def put(self, key, arrays):
+        """ Store a dictionary of arrays under key, then evict old entries if the cache is over its limits. """
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = self._get_path(key) + '.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, self._get_path(key))
+        self.evict()
+        return
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith('.npz') and not name.endswith('.tmp.npz'):
+                stat = os.stat(os.path.join(self.path, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        entries.sort()
+        total = sum([entry[1] for entry in entries])
+        while len(entries) > 0 and (total > self.max_bytes or len(entries) > self.max_entries):
+            _, size, name = entries.pop(0)
+            os.remove(os.path.join(self.path, name))
+            total -= size
+            log.debug('Result cache evicted ' + name)
+        return
+
+    def clear(self):
+        if os.path.isdir(self.path):
+            for name in os.listdir(self.path):
+                if name.endswith('.npz'):
+                    os.remove(os.path.join(self.path, name))
+        return
@@ -0,0 +1,157 @@
+#!/usr/bin/python
+import logging
+import numpy as np
+from integrator import Integrator
+from recorder import Recorder
+from sensitivity import Sensitivity
+
+log = logging.getLogger(__name__)
+
+
+class Calibration:
+    """ Fit uncertain model parameters (strap A/L, masses, emissivities, ...) to measured temperature logs by
+    Levenberg-Marquardt.  The misfit is the sum of squared differences between the model and the measured
+    temperatures, each divided by the measurement error sigma (K).  The parameters, keyed as in sensitivity.py,
+    eg ['area_length:det_link', 'mass:block', 'emissivity:window'], are fitted as the logarithm of their ratio
+    to the nominal value, which keeps them positive.
+
+    Each iteration makes one Sensitivity run at the current parameters, giving the residuals and their exact
+    Jacobian in a single pass, and then tries a set of Levenberg-Marquardt steps with different damping factors
+    together as one batched run of the vectorised Network (see Network.replace), keeping the best.
+
+    The log is a csv file with a header line naming 'time' (s) and the logged capacitors, eg.
+
+        time, getter, block
+        0., 295.1, 294.8
+        60., 291.4, 293.9
+
+    empty fields being missing values.
+    """
+
+    def __init__(self, network, keys, times, measured, **kwargs):
+        self.network = network
+        self.keys = keys
+        self.sigma = kwargs.get('sigma', 0.1)               # Measurement error (K)
+        self.delta_time = kwargs.get('delta_time', 1.)      # Model tick (s), must be stable for explicit Euler
+        self.max_iter = kwargs.get('max_iter', 30)
+        self.tol = kwargs.get('tol', 1.0E-6)                # Stop when the misfit falls by less than this fraction
+        self.dampings = kwargs.get('dampings', [0.1, 1., 10., 100.])     # Candidate damping factors per iteration
+        sensitivity = Sensitivity(network, keys)
+        self.nominal, self.columns = sensitivity.values, sensitivity.columns
+        self.times = np.array(times, dtype=float)
+        names = list(measured.keys())
+        for name in names:
+            if name not in network.names:
+                raise ValueError("Logged capacitor {:s} is not in the model".format(name))
+        self.nodes = np.array([network.names.index(name) for name in names], dtype=int)
+        self.measured = np.array([measured[name] for name in names], dtype=float).T      # (n_times, n_logged)
+        self.valid = np.isfinite(self.measured)
+        self.values, self.errors, self.cost = None, None, None
+        self.history = []                                   # (misfit, values) after each iteration
+        self.n_runs = 0
+        return
+
+    @staticmethod
+    def read_log(path):
+        """ Read a measured log, returning the times and a dictionary of temperature series keyed by name. """
+        with open(path, 'r') as text_file:
+            records = [record for record in text_file.read().splitlines() if len(record.strip()) > 0]
+        header = [token.strip() for token in records[0].split(',')]
+        if header[0] != 'time':
+            raise ValueError("{:s}: the first column of a log must be 'time'".format(path))
+        rows = []
+        for record in records[1:]:
+            tokens = [token.strip() for token in record.split(',')]
+            rows.append([float(token) if len(token) > 0 else np.nan for token in tokens])
+        values = np.array(rows)
+        return values[:, 0], {name: values[:, i] for i, name in enumerate(header[1:], start=1)}
+
+    def get_network(self, values):
+        """ Network with the parameters set to values, batched if values has shape (n_candidates, n_keys). """
+        values = np.array(values)
+        batch = values.shape[:-1]
+        fields = {}
+        for j, (field, index) in enumerate(self.columns):
+            if field not in fields:
+                fields[field] = np.array(np.broadcast_to(getattr(self.network, field),
+                                                         batch + getattr(self.network, field).shape))
+            fields[field][..., index] = values[..., j]
+        return self.network.replace(**fields)
+
+    def _interpolate(self, sample_times, samples):
+        """ Samples (n_samples, ...) interpolated linearly to the logged times. """
+        k = np.clip(np.searchsorted(sample_times, self.times, side='right') - 1, 0, len(sample_times) - 2)
+        frac = (self.times - sample_times[k]) / (sample_times[k+1] - sample_times[k])
+        frac = frac.reshape((-1,) + (1,) * (samples.ndim - 1))
+        return samples[k] + frac * (samples[k+1] - samples[k])
+
+    def get_residuals(self, sample_times, temps):
+        """ Weighted misfit (model - measured) / sigma at every valid logged point, from model temperatures of
+        shape (n_samples, ..., n_nodes), giving shape (..., n_points).
+        """
+        model = self._interpolate(sample_times, temps)[..., self.nodes]          # (n_times, ..., n_logged)
+        model = np.moveaxis(model, 0, -2)
+        return ((model - np.where(self.valid, self.measured, 0.)) / self.sigma)[..., self.valid]
+
+    def linearise(self, values):
+        """ Residuals and their Jacobian with respect to the log parameters, from one sensitivity run. """
+        sensitivity = Sensitivity(self.get_network(values), self.keys)
+        sensitivity.run(self.times[-1], self.delta_time)
+        self.n_runs += 1
+        residuals = self.get_residuals(sensitivity.times, sensitivity.temps)
+        slopes = self._interpolate(sensitivity.times, sensitivity.sensitivities)[:, self.nodes, :]
+        jacobian = slopes[self.valid] * values / self.sigma                 # d residual / d log(value)
+        return residuals, jacobian
+
+    def evaluate(self, candidates):
+        """ Misfit of each row of candidates (n_candidates, n_keys), run together as one batch. """
+        network = self.get_network(candidates)
+        n_candidates = len(candidates)
+        n_steps = int(round(self.times[-1] / self.delta_time))
+        temps = np.array(np.broadcast_to(network.temperatures, (n_candidates, network.n_nodes)))
+        recorder = Recorder(network.names, network.con_names, network.rad_names, n_samples=n_steps + 1,
+                            n_variants=n_candidates)
+        Integrator(network).run(temps, n_steps * self.delta_time, self.delta_time, recorder)
+        self.n_runs += 1
+        n = recorder.n_samples                 # Samples hold the temperatures at the end of each step
+        sample_times = np.concatenate(([0.], recorder.times[0:n] + self.delta_time))
+        samples = np.concatenate((temps[np.newaxis], recorder.temps[0:n]))
+        residuals = self.get_residuals(sample_times, samples)
+        return np.sum(residuals * residuals, axis=-1)
+
+    def fit(self, **kwargs):
+        """ Fit the parameters, starting from their nominal values (or 'start'), returning a dictionary of the
+        fitted values.  self.errors holds their one sigma uncertainties, from the Jacobian at the solution.
+        """
+        values = np.array(kwargs.get('start', self.nominal), dtype=float)
+        residuals, jacobian = self.linearise(values)
+        cost, damping = float(np.sum(residuals * residuals)), 1.0E-3
+        for i in range(0, self.max_iter):
+            normal = jacobian.T @ jacobian
+            gradient = jacobian.T @ residuals
+            dampings = damping * np.array(self.dampings)
+            steps = np.array([np.linalg.solve(normal + d * np.diag(np.diag(normal)) + 1.0E-12 * np.eye(len(values)),
+                                              -gradient) for d in dampings])
+            candidates = values * np.exp(steps)
+            costs = self.evaluate(candidates)
+            best = int(np.argmin(costs))
+            if not costs[best] < cost:
+                damping = 10. * dampings[-1]
+                log.debug("Calibration iteration {:d}, no improvement, damping {:.1e}".format(i, damping))
+                if damping > 1.0E10:
+                    break
+                continue
+            improvement = (cost - costs[best]) / cost
+            values, damping = candidates[best], dampings[best]
+            residuals, jacobian = self.linearise(values)
+            cost = float(np.sum(residuals * residuals))
+            self.history.append((cost, values))
+            log.info("Calibration iteration {:d}, misfit {:.4g}".format(i, cost))
+            if improvement < self.tol:
+                break
+        self.values, self.cost = values, cost
+        n_points, n_keys = jacobian.shape
+        scale = cost / max(n_points - n_keys, 1)             # Reduced chi-squared
+        covariance = np.linalg.pinv(jacobian.T @ jacobian) * max(scale, 1.)
+        self.errors = values * np.sqrt(np.diag(covariance))
+        return dict(zip(self.keys, values))
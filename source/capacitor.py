@@ -1,12 +1,13 @@
 #!/usr/bin/python
-import numpy as np
 from plot import Plot
 from filer import Filer
+from table import Table
 
 
 class Capacitor:
 
     kint_v_temp, kint_groups = None, None
+    table = None
     index = 0
 
     def __init__(self, params, **kwargs):
@@ -19,12 +20,11 @@ class Capacitor:
 
         self.cooler_name = kwargs.get('cooler', None)
         self.new_temperature = self.temperature
-        if Capacitor.kint_v_temp is None:
-            filer = Filer()
-            Capacitor.kint_v_temp, Capacitor.kint_groups = filer.load_data('capacity.csv')
+        Capacitor.load_data()
+        self.material_id = Capacitor.table.get_id(self.material)
 
         self.connectors, self.radiators = [], []
-        self.temp_v_time, self.power_v_time = [], []
+        self.power_v_time = []
         self.position = 0., 0.      # Tuple holding the position of the element in the thermal model diagram
         self.active_paths = {'con': None, 'rad': None, 'cool': None}
         self.is_cooler = False
@@ -32,6 +32,15 @@ class Capacitor:
         Capacitor.index += 1
         return
 
+    @staticmethod
+    def load_data():
+        """ Load the heat capacity table, if it has not already been loaded. """
+        if Capacitor.kint_v_temp is None:
+            filer = Filer()
+            Capacitor.kint_v_temp, Capacitor.kint_groups = filer.load_data('capacity.csv')
+            Capacitor.table = Table(Capacitor.kint_v_temp)
+        return
+
     def __str__(self):
         text = "{:s}\n{:s}, {:.1f} kg".format(self.name, self.material[0:2], self.mass)
         return text
@@ -40,7 +49,6 @@ class Capacitor:
         """ Find the new temperature of this body after delta_time by summing the heat flow from connected
         elements.  The new temperature must be applied once they have been calculated for all elements.
         """
-        self.temp_v_time.append([time, self.temperature])
         tot_power = self.con_power + self.rad_power
         heat = tot_power * delta_time
         self.temperature = Capacitor.get_new_temperature(self, heat)
@@ -59,11 +67,8 @@ class Capacitor:
 
     @staticmethod
     def get_new_temperature(element, heat):
-        material = element.material
         temp = element.temperature
-        temps = Capacitor.kint_v_temp['Temp']
-        caps = Capacitor.kint_v_temp[material]
-        cap = np.interp(temp, temps, caps)
+        cap = Capacitor.table.lookup(element.material_id, temp)
         new_temperature = temp + heat / (element.mass * cap)
         return new_temperature
 
@@ -0,0 +1,153 @@
+#!/usr/bin/python
+""" Numerical checks of the model's solvers against independent references, run from the repository root, eg.
+
+    python source/check.py
+    python source/check.py --only exponential
+
+Each check prints its worst error against its limit, and the exit status is 1 if any check fails.
+"""
+import sys
+import time
+import argparse
+import numpy as np
+from loader import Loader
+from calibration import Calibration
+from integrator import Integrator
+from recorder import Recorder
+from reduction import Reduction
+from sensitivity import Sensitivity
+from thermal import Thermal
+
+
+class Check:
+
+    names = ['equivalence', 'exponential', 'reduction', 'sensitivity', 'calibration']
+
+    def __init__(self, **kwargs):
+        self.model_name = kwargs.get('model_name', 'marvel')
+        self.run_time = kwargs.get('run_time', 4 * 3600.)   # Simulated time per check (s)
+        self.results = []
+        return
+
+    def run_network(self, network, delta_time, **kwargs):
+        """ Final temperatures of an Integrator run of network, and the Integrator. """
+        integrator = Integrator(network, **kwargs)
+        recorder = Recorder(network.names, network.con_names, network.rad_names, interval=600.,
+                            n_samples=int(self.run_time / 600.) + 2)
+        temps = integrator.run(network.temperatures, self.run_time, delta_time, recorder)
+        return temps, integrator
+
+    def check_equivalence(self):
+        """ Network mode explicit Euler against the object loop (Thermal.run_objects), whose recorded histories
+        should agree exactly, including at ticks which do not divide the run time in floating point.
+        """
+        error = 0.
+        for delta_time, run_time in [(0.1, 10.), (0.3, 60.), (0.7, 100.), (1., 3600.)]:
+            histories = []
+            for mode in ['object', 'network']:
+                thermal = Thermal()
+                thermal.load_model(self.model_name, plot=False)
+                recorder = thermal.run(mode=mode, run_time=run_time, delta_time=delta_time, plot=False)
+                histories.append(np.column_stack((recorder.times[0:recorder.n_samples],
+                                                  recorder.temps[0:recorder.n_samples])))
+            if histories[0].shape != histories[1].shape:
+                return np.inf, 1.0E-9, 'K'
+            error = max(error, np.max(np.abs(histories[1] - histories[0])))
+        return error, 1.0E-9, 'K'
+
+    def check_exponential(self):
+        """ Exponential integrator at a 60 s step against backward Euler at 1 s. """
+        network = Loader.load_network(self.model_name)
+        reference, _ = self.run_network(network, 1., method='backward_euler')
+        temps, _ = self.run_network(network, 60., method='exponential')
+        return np.max(np.abs(temps - reference)), 0.05, 'K'
+
+    def check_reduction(self, delta_time=60., ratio=5., max_drop=0.1):
+        """ Reduced model against the full model, both run by backward Euler, which should stay within the
+        steady state drop allowed across a merged conductor (see reduction.py).  Fails if nothing is merged.
+        """
+        histories = []
+        for reduce in [None, ratio]:
+            thermal = Thermal()
+            thermal.load_model(self.model_name, plot=False)
+            if reduce is not None:
+                reduction = Reduction(thermal.capacitors, thermal.conductors, thermal.radiators, thermal.enclosures,
+                                      delta_time, ratio=ratio, max_drop=max_drop, boundary_mass=Thermal.boundary_mass)
+                if len(reduction.capacitors) == len(thermal.capacitors):
+                    return np.inf, max_drop, 'K'
+            recorder = thermal.run(mode='network', integrator='backward_euler', run_time=self.run_time,
+                                   delta_time=delta_time, record_interval=600., reduce=reduce, reduce_drop=max_drop,
+                                   plot=False)
+            histories.append(recorder.temps[0:recorder.n_samples])
+        return np.max(np.abs(histories[1] - histories[0])), max_drop, 'K'
+
+    def check_sensitivity(self, run_time=3600., delta_time=1., rel_step=1.0E-5):
+        """ Forward sensitivities of one parameter of each kind against central finite differences of the
+        same explicit Euler run, as the largest error relative to the largest finite difference.
+        """
+        network = Loader.load_network(self.model_name)
+        keys = ['area_length:' + network.con_element_names[0], 'emissivity:' + network.rad_element_names[0],
+                'area:' + network.rad_element_names[0], 'mass:' + network.names[0],
+                'temperature:' + network.names[0]]
+        sensitivity = Sensitivity(network, keys)
+        sensitivities = sensitivity.run(run_time, delta_time)
+        error = 0.
+        for j, (field, index) in enumerate(sensitivity.columns):     # Perturb each parameter up and down
+            step = rel_step * abs(sensitivity.values[j])
+            finals = []
+            for sign in [1., -1.]:
+                values = np.array(getattr(network, field), dtype=float)
+                values[index] += sign * step
+                variant = Sensitivity(network.replace(**{field: values}), keys[0:1])
+                variant.run(run_time, delta_time)
+                finals.append(variant.temps[-1])
+            differences = (finals[0] - finals[1]) / (2. * step)
+            error = max(error, np.max(np.abs(differences - sensitivities[:, j])) / np.max(np.abs(differences)))
+        return error, 1.0E-6, ''
+
+    def check_calibration(self, sigma=0.05, seed=1):
+        """ Calibration against a synthetic log, made by running the model with known parameter ratios and adding
+        noise of sigma kelvin, giving the largest difference between the fitted and true values in units of the
+        fitted one sigma errors.  Over many seeds these follow a unit normal distribution, so the limit of 4
+        allows for the largest of the four.
+        """
+        network = Loader.load_network(self.model_name)
+        keys = ['area_length:' + network.con_element_names[0], 'area_length:' + network.con_element_names[1],
+                'mass:' + network.names[2], 'emissivity:' + network.rad_element_names[0]]
+        ratios = np.array([1.3, 0.8, 1.2, 0.7])
+        logged = [0, 2, 4]
+        calibration = Calibration(network, keys, [0.], {network.names[0]: [0.]})
+        truth = calibration.nominal * ratios
+        sensitivity = Sensitivity(calibration.get_network(truth), keys[0:1])
+        sensitivity.run(self.run_time, 1., record_interval=60.)
+        rng = np.random.default_rng(seed)
+        noisy = sensitivity.temps[:, logged] + sigma * rng.standard_normal((len(sensitivity.times), len(logged)))
+        measured = {network.names[node]: noisy[:, i] for i, node in enumerate(logged)}
+        calibration = Calibration(network, keys, sensitivity.times, measured, sigma=sigma)
+        fit = calibration.fit()
+        fitted = np.array([fit[key] for key in keys])
+        return np.max(np.abs(fitted - truth) / calibration.errors), 4., 'sd'
+
+    def report(self, name, error, limit, unit, wall_time):
+        passed = bool(error <= limit)
+        self.results.append((name, passed))
+        print("{:<14s} {:10.3g} {:<3s} (limit {:.3g}) {:6.1f} s  {:s}".format(name, error, unit, limit, wall_time,
+                                                                            'pass' if passed else 'FAIL'))
+        return passed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check the thermal model solvers against independent references')
+    parser.add_argument('--only', nargs='+', choices=Check.names, default=Check.names, help='checks to run')
+    args = parser.parse_args(argv)
+
+    check = Check()
+    for name in args.only:
+        t0 = time.perf_counter()
+        error, limit, unit = getattr(check, 'check_' + name)()
+        check.report(name, error, limit, unit, time.perf_counter() - t0)
+    return 0 if all([passed for _, passed in check.results]) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/python
+import os
+import time
+import hashlib
+import numpy as np
+
+
+class Checkpoint:
+    """ Periodic snapshot of an Integrator run, written to a small .npz file, from which the run can be resumed
+    after a crash or forked into several what-if continuations.  A checkpoint holds the node temperatures, the
+    time, the current (and for bdf2 the previous) step, the temperatures of any meshed conductor segments, the
+    number of samples the Recorder had passed to its sink and a hash of the compiled network, which is checked
+    on resume.
+
+    Only the samples already written to a Recorder sink survive a crash, so a long run that is to be resumed
+    should stream its results to disk (see sink.py).
+    """
+
+    version = 3
+
+    def __init__(self, path, **kwargs):
+        self.path = path
+        self.interval = kwargs.get('interval', 3600.)           # Simulated seconds between checkpoints
+        self.wall_interval = kwargs.get('wall_interval', None)  # Also write after this many wall clock seconds
+        self.next_time = None
+        self.last_wall = time.perf_counter()
+        self.n_written = 0
+        return
+
+    @staticmethod
+    def get_key(network):
+        """ Hash of the compiled network arrays, identifying the model a checkpoint belongs to.  The node
+        temperatures are left out, since they are the state of a run rather than part of the model.
+        """
+        sha = hashlib.sha1()
+        for field in network.fields:
+            if field == 'temperatures':
+                continue
+            value = getattr(network, field)
+            sha.update(field.encode())
+            sha.update(np.ascontiguousarray(value).tobytes() if isinstance(value, np.ndarray) else
+                       repr(list(value)).encode())
+        return sha.hexdigest()
+
+    def is_due(self, sim_time):
+        if self.next_time is None:
+            self.next_time = sim_time + self.interval
+        if sim_time >= self.next_time:
+            return True
+        return self.wall_interval is not None and time.perf_counter() - self.last_wall >= self.wall_interval
+
+    def write(self, network, recorder, state):
+        """ Write the run state (a dictionary of time, step, temps, temps_prev and step_prev), first flushing
+        the recorder to its sink so that the recorded position is on disk.  The file is replaced atomically.
+        """
+        if recorder.sink is not None:
+            recorder.flush()
+        temps_prev, strap_temps = state['temps_prev'], state.get('strap_temps', None)
+        arrays = {'version': np.array(Checkpoint.version), 'key': np.array(Checkpoint.get_key(network)),
+                  'names': np.array(network.names), 'time': np.array(state['time']),
+                  'step': np.array(state['step']), 'temps': np.array(state['temps']),
+                  'has_prev': np.array(temps_prev is not None),
+                  'temps_prev': np.zeros(0) if temps_prev is None else np.array(temps_prev),
+                  'step_prev': np.array(np.nan if state['step_prev'] is None else state['step_prev']),
+                  'position': np.array(recorder.get_position()),
+                  'strap_temps': np.zeros(0) if strap_temps is None else np.array(strap_temps)}
+        tmp_path = self.path + '.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, self.path)
+        self.next_time = state['time'] + self.interval
+        self.last_wall = time.perf_counter()
+        self.n_written += 1
+        return
+
+    @staticmethod
+    def read(path, network=None):
+        """ Read a checkpoint into a state dictionary which can be passed to Integrator.run(resume=state).  If
+        the network is given it must be the one the checkpoint was written from.  To fork a run onto a changed
+        model read it without the network and resume with fork=True, which matches the nodes by position, eg.
+        to continue a marvel run from hour 12 with its pt16_hp cooler replaced by a pt30_hp (a copy of
+        marvel.csv, marvel_pt30.csv, with the 'coo' line renamed),
+
+            state = Checkpoint.read('marvel_12h.npz')
+            network = Loader.load_network('marvel_pt30')
+            Integrator(network).run(network.temperatures, 24 * 3600., 1., recorder, resume=state, fork=True)
+
+        or python source/main.py marvel_pt30 --resume marvel_12h.npz --fork --run-time 86400.
+        """
+        with np.load(path, allow_pickle=False) as arrays:
+            if int(arrays['version']) != Checkpoint.version:
+                raise ValueError("{:s} was written by checkpoint version {:d}".format(path, int(arrays['version'])))
+            state = {'key': str(arrays['key']), 'names': [str(name) for name in arrays['names']],
+                     'time': float(arrays['time']), 'step': float(arrays['step']), 'temps': arrays['temps'],
+                     'temps_prev': arrays['temps_prev'] if bool(arrays['has_prev']) else None,
+                     'step_prev': float(arrays['step_prev']) if bool(arrays['has_prev']) else None,
+                     'position': int(arrays['position']),
+                     'strap_temps': arrays['strap_temps'] if arrays['strap_temps'].size > 0 else None}
+        if network is not None and Checkpoint.get_key(network) != state['key']:
+            raise ValueError("{:s} was written from a different model".format(path))
+        return state
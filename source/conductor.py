@@ -2,26 +2,45 @@
 import numpy as np
 from plot import Plot
 from filer import Filer
+from table import Table
+from capacitor import Capacitor
 
 
 class Conductor:
 
-    data = None
+    data, table = None, None
     index = 0
 
-    def __init__(self, params, caps):
+    def __init__(self, params, caps, **kwargs):
         self.name, self.material, pxsarea, plength, self.color = params
         self.xsarea_length = 1.0e-6 * float(pxsarea) / float(plength)
+        self.segments = kwargs.get('segments', 1)       # Mesh into this many segments with heat capacity (network mode)
+        self.mass = kwargs.get('mass', 0.)              # Total mass (kg) of a meshed conductor
+        capacity_material = kwargs.get('capacity_material', None)      # capacity.csv material of a meshed conductor
+        self.capacity_id = 0
+        if self.segments > 1:
+            Capacitor.load_data()
+            if capacity_material not in Capacitor.table.ids:
+                raise ValueError("Meshed conductor {:s} needs a heat capacity material, not {:s}".format(
+                    self.name, str(capacity_material)))
+            self.capacity_id = Capacitor.table.get_id(capacity_material)
         self.from_to_name = caps[0].name + '->' + caps[1].name
         self.capacitors = caps                    # Massive heat capacitors connected by this conductor
         self.power_v_time = []
+        Conductor.load_data()
+        self.material_id = Conductor.table.get_id(self.material)
+        self.index = Conductor.index
+        Conductor.index += 1
+        return
+
+    @staticmethod
+    def load_data():
+        """ Load the integrated conductivity table, if it has not already been loaded. """
         if Conductor.data is None:
             filer = Filer()
-            data, groups = filer.load_data('conductivity.csv')
-            data = Conductor.convert_to_integrals(data)
+            data, groups = filer.load_data('conductivity.csv', process=Conductor.convert_to_integrals)
             Conductor.data, Conductor.groups = data, groups
-        self.index = Conductor.index
-        Conductor.index += 1
+            Conductor.table = Table(data)
         return
 
     def __str__(self):
@@ -45,28 +64,21 @@ class Conductor:
         """ Replace input thermal conductivity values (W/m/K) into integrals (W/m (T))
         """
         temps = np.array(data['Temp'])
-        materials = list(data.keys())
-        for material in materials[1:]:
-            ks = data[material]
-            n = len(ks)
-            kints, kint = np.zeros(n), 0.
-            temp_im1, k_im1 = 0., 0.
-            for i in range(0, n):
-                temp_i, k_i = temps[i], ks[i]
-                dtemp = temp_i - temp_im1
-                kint += 0.5 * dtemp * (k_im1 + k_i)
-                kints[i] = kint
-                temp_im1, k_im1 = temp_i, k_i
-            data[material] = kints
+        materials = list(data.keys())[1:]
+        dtemps = np.diff(temps, prepend=0.)                 # Integrate from K(0 K) = 0
+        ks = np.array([data[material] for material in materials]).reshape(len(materials), len(temps))
+        k_im1s = np.concatenate((np.zeros((len(materials), 1)), ks[:, :-1]), axis=1)
+        kints = np.cumsum(0.5 * dtemps * (k_im1s + ks), axis=1)
+        for i, material in enumerate(materials):
+            data[material] = kints[i]
         return data
 
     def transfer_heat(self, time):
         cap_a, cap_b = self.capacitors[0], self.capacitors[1]
         ta, tb = cap_a.temperature, cap_b.temperature
-        material, area_length = self.material, self.xsarea_length
-        temps = Conductor.data['Temp']
-        kints = Conductor.data[material]
-        [kta, ktb] = np.interp([ta, tb], temps, kints)
+        material_id, area_length = self.material_id, self.xsarea_length
+        kta = Conductor.table.lookup(material_id, ta)
+        ktb = Conductor.table.lookup(material_id, tb)
         power = area_length * (kta - ktb)                     # power < 0. if t1 > t2
         cap_a.con_power -= power                              # Ta > Tb, cap_a gets hotter, cap_b gets cooler
         cap_b.con_power += power
@@ -1,13 +1,14 @@
 #!/usr/bin/python
-import numpy as np
 from plot import Plot
 from filer import Filer
 from capacitor import Capacitor
+from table import Table
 
 
 class Cooler(Capacitor):
 
     cool_v_temp, cool_groups = None, None
+    table = None
     index = 0
     cooler_names = ['pt16_st', 'pt16_hp', 'pt30_st', 'pt30_hp']
 
@@ -20,19 +21,29 @@ class Cooler(Capacitor):
         self.con_power, self.rad_power = 0., 0.
         self.new_temperature = self.temperature
         self.connectors, self.radiators = [], []
-        self.temp_v_time, self.power_v_time = [], []
+        self.power_v_time = []
         self.position = 0., 0.      # Tuple holding the position of the element in the thermal model diagram
         self.is_cooler = True
 
-        if Cooler.cool_v_temp is None:
-            filer = Filer()
-            Cooler.cool_v_temp, Cooler.cool_groups = filer.load_data('coolers.csv')
+        Cooler.load_data()
+        self.material_id = Capacitor.table.get_id(self.material)
+        self.cooler_id = Cooler.table.get_id(self.name)
 
         self.active_paths = {'con': None, 'rad': None}
         self.index = Capacitor.index
         Capacitor.index += 1
         return
 
+    @staticmethod
+    def load_data():
+        """ Load the cooler power and heat capacity tables, if they have not already been loaded. """
+        if Cooler.cool_v_temp is None:
+            filer = Filer()
+            Cooler.cool_v_temp, Cooler.cool_groups = filer.load_data('coolers.csv')
+            Cooler.table = Table(Cooler.cool_v_temp)
+        Capacitor.load_data()
+        return
+
     def __str__(self):
         text = "{:s}\n{:s}, {:.1f} kg".format(self.name, self.material[0:2], self.mass)
         return text
@@ -41,11 +52,8 @@ class Cooler(Capacitor):
         """ Find the new temperature of this body after delta_time by summing the heat flow from connected
         elements.  The new temperature must be applied once they have been calculated for all elements.
         """
-        self.temp_v_time.append([time, self.temperature])
         temp = self.temperature
-        cool_temps = Cooler.cool_v_temp['Temp']
-        cool_powers = Cooler.cool_v_temp[self.name]
-        cool_power = np.interp(temp, cool_temps, cool_powers)
+        cool_power = Cooler.table.lookup(self.cooler_id, temp)
         tot_power = self.con_power + self.rad_power - cool_power
         heat = tot_power * delta_time
         self.temperature = Capacitor.get_new_temperature(self, heat)
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+import numpy as np
+
+
+class Enclosure:
+    """ Radiative exchange between several mutually viewing grey diffuse surfaces (eg a radiation shield and
+    the parts inside it), each surface being one face of a capacitor.  The view factors F_ij (the fraction of
+    the radiation leaving surface i which arrives at surface j) are reduced once, with the emissivities, to
+    Gebhart factors
+
+        B = (I - F (1 - e))^-1 F e,
+
+    B_ij being the fraction of the emission of surface i which is finally absorbed by surface j after any number
+    of diffuse reflections.  The net radiative power into every surface is then a single matrix-vector product
+    exchange @ T^4, however many surfaces the enclosure has.  A row of F summing to less than one leaves the
+    remainder of that surface's radiation to escape to space at 0 K.
+    """
+
+    sigma = 5.6703744E-8                    # Stephan-Boltzmann constant W m-2 K-4
+
+    def __init__(self, params, caps):
+        self.name, pemissivities, pareas, self.color = params
+        self.capacitors = caps                    # Capacitor of each surface
+        self.emissivities = np.array([float(token) for token in pemissivities.split(';')])
+        self.areas = np.array([float(token) for token in pareas.split(';')])
+        n_surfaces = len(caps)
+        if len(self.emissivities) != n_surfaces or len(self.areas) != n_surfaces:
+            raise ValueError("Enclosure {:s} needs an emissivity and area for each of its {:d} surfaces".format(
+                self.name, n_surfaces))
+        self.view_factors = []                    # Rows of F, added by add_view_factors
+        self.exchange = None
+        return
+
+    def __str__(self):
+        text = "{:s}\n{:d} surfaces".format(self.name, len(self.capacitors))
+        return text
+
+    def add_view_factors(self, row):
+        """ Append the next row of the view factor matrix, one value for each surface. """
+        if len(row) != len(self.capacitors):
+            raise ValueError("Enclosure {:s} view factor row needs {:d} values".format(self.name,
+                                                                                      len(self.capacitors)))
+        self.view_factors.append([float(value) for value in row])
+        return
+
+    def get_exchange(self):
+        """ Matrix (W/K^4) giving the net radiative power into each surface from the fourth powers of the
+        surface temperatures.  It is computed from the view factors on first use.
+        """
+        if self.exchange is not None:
+            return self.exchange
+        n_surfaces = len(self.capacitors)
+        view_factors = np.array(self.view_factors)
+        if view_factors.shape != (n_surfaces, n_surfaces):
+            raise ValueError("Enclosure {:s} needs a {:d} x {:d} view factor matrix, found {:d} rows".format(
+                self.name, n_surfaces, n_surfaces, len(self.view_factors)))
+        if np.any(view_factors < 0.) or np.any(np.sum(view_factors, axis=1) > 1. + 1.0E-6):
+            raise ValueError("Enclosure {:s} view factors must be positive with rows summing to <= 1".format(
+                self.name))
+        area_views = self.areas[:, np.newaxis] * view_factors
+        if not np.allclose(area_views, area_views.T, rtol=1.0E-2, atol=1.0E-12):
+            raise ValueError("Enclosure {:s} view factors do not satisfy A_i F_ij = A_j F_ji".format(self.name))
+        emissivities = self.emissivities
+        reflect = np.eye(n_surfaces) - view_factors * (1. - emissivities)
+        gebhart = np.linalg.solve(reflect, view_factors * emissivities)
+        emitted = emissivities * self.areas                 # Surface i emits e_i A_i sigma T_i^4
+        # Power into j = sum_i e_i A_i B_ij sigma T_i^4 - e_j A_j sigma T_j^4
+        self.exchange = Enclosure.sigma * (gebhart.T * emitted - np.diag(emitted))
+        return self.exchange
+
+    def transfer_heat(self, time):
+        """ Add the net radiative power into every surface onto its capacitor, returning the powers. """
+        temps = np.array([cap.temperature for cap in self.capacitors])
+        powers = self.get_exchange() @ (temps*temps*temps*temps)
+        for capacitor, power in zip(self.capacitors, powers):
+            capacitor.rad_power += power
+        return powers
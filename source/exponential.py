@@ -0,0 +1,86 @@
+#!/usr/bin/python
+import numpy as np
+try:
+    import scipy.linalg as scipy_dense
+except ImportError:
+    scipy_dense = None
+
+
+class Exponential:
+    """ Exponential stepping of a compiled Network about a linearisation.  Near equilibrium the heat balance
+    C dT/dt = P(T) is close to linear, so with A = C^-1 J, J being the network Jacobian (conductances, radiative
+    terms and cooler slopes) and C the node heat capacities at the linearisation point,
+
+        T(t + h) = T(t) + h phi(A h) C^-1 P(T(t)),      phi(z) = (e^z - 1) / z,
+
+    is exact for a linear network over a step of any length, and unlike an explicit step it stays stable however
+    long the step.  The propagator h phi(A h) is cached, so a step costs one power evaluation and one matrix-
+    vector product.  Since the actual powers P(T(t)) are used at every step the run still settles on the true
+    equilibrium; the network is relinearised once any node drifts more than 'tol' kelvin from the temperatures
+    it was linearised at, or the step changes.
+
+    The propagator is dense, of size n_nodes^2, so this suits models of up to a few thousand nodes.  It is
+    found from the exponential of an augmented matrix with scipy, or else from an eigendecomposition of A.
+
+    Meshed conductors (see strap.py) enter A through their Jacobian, and get_mean_changes gives the node changes
+    averaged over the step, h phi2(A h) C^-1 P(T(t)) with phi2(z) = (e^z - 1 - z) / z^2, so that the straps are
+    advanced with the heat the nodes actually exchanged with them.
+    """
+
+    def __init__(self, network, **kwargs):
+        self.network = network
+        self.tol = kwargs.get('tol', 1.)                # Relinearise after a drift of this many K at any node
+        self.lin_temps, self.lin_step = None, None
+        self.propagator, self.mean_propagator = None, None
+        self.n_linearisations = 0
+        return
+
+    def linearise(self, temps, step, source_jacobian=None):
+        """ Compute the propagator step * phi(A step) about temperatures temps, with source_jacobian (the
+        meshed conductors, see Straps.get_jacobian) added to the network Jacobian.
+        """
+        network = self.network
+        n_nodes = network.n_nodes
+        heat_caps = network.masses * network.get_capacities(temps)
+        jacobian = network.get_jacobian(temps)
+        if source_jacobian is not None:
+            jacobian = jacobian + source_jacobian
+        rates = jacobian / heat_caps[..., np.newaxis]                          # A = C^-1 J
+        n_blocks = 2 if source_jacobian is None else 3                         # Add phi2 for the straps
+        if scipy_dense is not None:
+            augmented = np.zeros(rates.shape[:-2] + (n_blocks * n_nodes, n_blocks * n_nodes))
+            augmented[..., 0:n_nodes, 0:n_nodes] = rates * step
+            augmented[..., 0:n_nodes, n_nodes:2 * n_nodes] = np.eye(n_nodes) * step
+            if n_blocks == 3:
+                augmented[..., n_nodes:2 * n_nodes, 2 * n_nodes:] = np.eye(n_nodes)
+            exponential = scipy_dense.expm(augmented)
+            propagator = exponential[..., 0:n_nodes, n_nodes:2 * n_nodes]     # = step * phi(A step)
+            mean_propagator = exponential[..., 0:n_nodes, 2 * n_nodes:]       # = step * phi2(A step)
+        else:
+            values, vectors = np.linalg.eig(rates)
+            inverse = np.linalg.inv(vectors)
+            z = values * step
+            small = np.abs(z) < 1.0E-5
+            safe_z = np.where(small, 1., z)
+            phis = np.where(small, 1. + 0.5 * z, np.expm1(z) / safe_z)
+            propagator = np.real((vectors * (step * phis)[..., np.newaxis, :]) @ inverse)
+            phis = np.where(small, 0.5 + z / 6., (np.expm1(z) - z) / safe_z**2)
+            mean_propagator = np.real((vectors * (step * phis)[..., np.newaxis, :]) @ inverse)
+        self.propagator = propagator / heat_caps[..., np.newaxis, :]           # Include C^-1
+        self.mean_propagator = None
+        if n_blocks == 3:
+            self.mean_propagator = mean_propagator / heat_caps[..., np.newaxis, :]
+        self.lin_temps, self.lin_step = np.array(temps), step
+        self.n_linearisations += 1
+        return
+
+    def step(self, temps, node_powers, step, source_jacobian=None):
+        """ Advance temps by step, relinearising first if they have drifted past tol. """
+        if (self.propagator is None or step != self.lin_step or
+                np.max(np.abs(temps - self.lin_temps)) > self.tol):
+            self.linearise(temps, step, source_jacobian)
+        return temps + (self.propagator @ node_powers[..., np.newaxis])[..., 0]
+
+    def get_mean_changes(self, node_powers):
+        """ Node temperature changes averaged over the last step, which was made with these node_powers. """
+        return (self.mean_propagator @ node_powers[..., np.newaxis])[..., 0]
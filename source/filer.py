@@ -1,43 +1,86 @@
 #!/usr/bin/python
+import os
+import hashlib
+import logging
+import zipfile
 import numpy as np
 
+log = logging.getLogger(__name__)
+
 
 class Filer:
 
+    cache_dir = './materials/cache/'
+    cache_version = '1'
+
     def __init__(self):
         return
 
     @staticmethod
-    def load_data(file_name):
+    def load_data(file_name, **kwargs):
+        """ Load a material data table from ./materials, returning dictionaries of NaN filled data columns and
+        their groups keyed by column name.  The optional 'process' function is applied to the data dictionary
+        after loading (eg Conductor.convert_to_integrals).  The processed tables are cached in a binary file
+        keyed by a hash of the csv file contents, so that later runs only need a single np.load.
+        """
+        process = kwargs.get('process', None)
         path = './materials/' + file_name
-        print('Loading ' + path)
+        with open(path, 'rb') as csv_file:
+            content = csv_file.read()
+        process_name = '' if process is None else process.__qualname__
+        key = hashlib.sha1(content + process_name.encode() + Filer.cache_version.encode()).hexdigest()[0:16]
+        cache_path = Filer.cache_dir + file_name.split('.')[0] + '_' + key + '.npz'
+        if os.path.exists(cache_path):
+            log.debug('Loading ' + cache_path)
+            try:
+                with np.load(cache_path, allow_pickle=False) as cache:
+                    names, groups, values = cache['names'], cache['groups'], cache['values']
+                data = {str(name): values[i] for i, name in enumerate(names)}
+                group = {str(name): str(groups[i]) for i, name in enumerate(names)}
+                return data, group
+            except (OSError, EOFError, KeyError, ValueError, zipfile.BadZipFile):
+                log.warning('Ignoring unreadable cache file ' + cache_path)
+
+        log.debug('Loading ' + path)
+        data, group = Filer.parse_csv(file_name, content.decode())
+        if process is not None:
+            data = process(data)
+        os.makedirs(Filer.cache_dir, exist_ok=True)
+        names = list(data.keys())
+        tmp_path = "{:s}.{:d}.tmp.npz".format(cache_path, os.getpid())     # Replaced atomically, so never torn
+        np.savez(tmp_path, names=np.array(names), groups=np.array([group[name] for name in names]),
+                 values=np.array([data[name] for name in names]))
+        os.replace(tmp_path, cache_path)
+        return data, group
+
+    @staticmethod
+    def parse_csv(file_name, text):
         data, group = {}, {}
-        with open(path, 'r') as text_file:
-            records = text_file.read().splitlines()
-            group_rec = records[2]
-            group_tokens = group_rec.split(',')
-            index_rec = records[3]
-            index_tokens = index_rec.split(',')
-            vals = []
-            for row, record in enumerate(records[4:]):
-                row_vals = []
-                tokens = record.split(',')
-                for col, token in enumerate(tokens):
-                    val = np.nan if token == '' else float(token)
-                    row_vals.append(val)
-                vals.append(row_vals)
-            text = file_name + " data available for - \n"
-            for col, token in enumerate(index_tokens):
-                col_vals = []
-                for row in range(0, len(vals)):
-                    val = vals[row][col]
-                    col_vals.append(val)
-                data[token] = col_vals
-                group[token] = group_tokens[col]
-                text += " {:s},".format(token)
-                if col % 6 == 0:
-                    text += "\n"
-            print(text)
+        records = text.splitlines()
+        group_rec = records[2]
+        group_tokens = group_rec.split(',')
+        index_rec = records[3]
+        index_tokens = index_rec.split(',')
+        vals = []
+        for row, record in enumerate(records[4:]):
+            row_vals = []
+            tokens = record.split(',')
+            for col, token in enumerate(tokens):
+                val = np.nan if token == '' else float(token)
+                row_vals.append(val)
+            vals.append(row_vals)
+        text = file_name + " data available for - \n"
+        for col, token in enumerate(index_tokens):
+            col_vals = []
+            for row in range(0, len(vals)):
+                val = vals[row][col]
+                col_vals.append(val)
+            data[token] = col_vals
+            group[token] = group_tokens[col]
+            text += " {:s},".format(token)
+            if col % 6 == 0:
+                text += "\n"
+        log.debug(text)
         temps = np.array(data['Temp'])
         for material in data.keys():
             v_nan = np.array(data[material])
@@ -50,30 +93,10 @@ class Filer:
         """ Replace nan values in kints with linear interpolated values.  Assume K(0) = 0.0 and K(T>Tmax) = K(Tmax)
         """
         is_nans = np.isnan(vals)
-        n = len(temps)
-        vals_out = np.zeros(n)
-        t_los, t_his, k_los, k_his = np.zeros(n), np.zeros(n), np.zeros(n), np.zeros(n)
-        t_lo, k_lo = 0., 0.
-        for i in range(0, n):
-            is_nan = is_nans[i]
-            if is_nan:
-                t_lo, k_lo = t_lo, k_lo
-            else:
-                t_lo, k_lo = temps[i], vals[i]
-            t_los[i], k_los[i] = t_lo, k_lo
-        t_hi, k_hi = t_lo, k_lo
-        for i in range(n-1, -1, -1):
-            is_nan = is_nans[i]
-            (t_hi, k_hi) = (t_hi, k_hi) if is_nan else (temps[i], vals[i])
-            t_his[i], k_his[i] = t_hi, k_hi
-        for i in range(0, n):
-            if is_nans[i]:
-                t_lo, t_hi, k_lo, k_hi = t_los[i], t_his[i], k_los[i], k_his[i]
-                dk_dt = 0.0 if t_hi == t_lo else (k_hi - k_lo) / (t_hi - t_lo)
-                vals_out[i] = k_lo + dk_dt * (temps[i] - t_lo)
-            else:
-                vals_out[i] = vals[i]
+        vals_out = np.array(vals, dtype=float)
+        if np.any(is_nans):
+            is_vals = np.logical_not(is_nans)
+            t_vals = np.concatenate(([0.], temps[is_vals]))
+            k_vals = np.concatenate(([0.], vals[is_vals]))
+            vals_out[is_nans] = np.interp(temps[is_nans], t_vals, k_vals)
         return vals_out
-
-
-
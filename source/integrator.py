@@ -0,0 +1,317 @@
+#!/usr/bin/python
+import numpy as np
+from strap import Straps
+from multirate import MultiRate
+from exponential import Exponential
+try:
+    import scipy.sparse as scipy_sparse
+    import scipy.sparse.linalg as scipy_linalg
+except ImportError:
+    scipy_sparse, scipy_linalg = None, None
+
+
+class Integrator:
+    """ Selectable time integration backends for a compiled Network.
+
+    'euler'           - explicit forward Euler, as used by Capacitor.find_new_temperature
+    'backward_euler'  - implicit Euler, solved by Newton iteration on the network Jacobian
+    'bdf2'            - implicit variable step, second order backward differentiation formula
+    'multirate'       - explicit, subcycling the nodes with short time constants within each step (multirate.py)
+    'exponential'     - matrix exponential of the linearised network, for long steps near equilibrium
+                        (exponential.py)
+
+    With adaptive=True the step size is controlled by an estimate of the local temperature error, so that the
+    tick can grow to minutes once the temperature gradients in the model relax.
+
+    backend='sparse' assembles the Jacobian as a scipy.sparse matrix and solves each Newton iteration with a
+    sparse LU factorisation, for networks with thousands of nodes.  The factorisation is kept and reused over
+    the following iterations and steps (modified Newton), and only made afresh when h moves by more than a
+    factor lu_ratio from the h it was made with (as the adaptive step changes) or the Newton correction shrinks
+    by less than a factor 1 / newton_rate per iteration.
+
+    With enthalpy=True the node heat balance is written in terms of the specific enthalpy H(T) instead of a heat
+    capacity frozen at the start of the step, so that large steps stay accurate where c(T) changes steeply
+    (below ~20 K).
+
+    With the dense backend, a batched network (see Network.replace) can be run with temperatures of shape
+    (n_variants, n_nodes).  All variants then share the same steps, the adaptive step being set by the worst.
+
+    Meshed conductors (see strap.py) are advanced by their own tridiagonal solver, linearised in the changes of
+    their end nodes, and the implicit and exponential methods include the strap end conductances in the network
+    Jacobian so that the straps do not limit their step.  With explicit Euler the end heat flows are held fixed
+    over the step.
+    """
+
+    methods = ['euler', 'backward_euler', 'bdf2', 'multirate', 'exponential']
+
+    def __init__(self, network, **kwargs):
+        self.compiled = network
+        self.network = network
+        self.straps, self.strap_temps = None, None
+        if np.any(network.con_segments > 1):
+            self.straps = Straps(network)
+            area_length = np.where(network.con_segments > 1, 0., network.con_area_length)
+            self.network = network.replace(con_area_length=area_length)     # Leave the meshed conductors to straps
+        self.method = kwargs.get('method', 'euler')
+        if self.method not in Integrator.methods:
+            raise ValueError("Unknown integrator {:s}, choose from {:s}".format(self.method,
+                                                                               str(Integrator.methods)))
+        self.multirate = None
+        if self.method == 'multirate':
+            self.multirate = MultiRate(self.network, safety=kwargs.get('safety', 0.5),
+                                       max_level=kwargs.get('max_level', 10))
+        self.exponential = None
+        if self.method == 'exponential':
+            self.exponential = Exponential(self.network, tol=kwargs.get('linear_tol', 1.))
+        self.adaptive = kwargs.get('adaptive', False)
+        backend = kwargs.get('backend', 'dense')         # 'dense' or 'sparse'
+        if backend not in ['dense', 'sparse']:
+            raise ValueError("Unknown backend {:s}, choose 'dense' or 'sparse'".format(backend))
+        if backend == 'sparse' and self.method == 'exponential':
+            raise ValueError("The exponential integrator needs the dense backend")
+        if backend == 'sparse' and scipy_sparse is None:
+            raise ImportError("The sparse integrator backend needs scipy")
+        self.sparse = backend == 'sparse'
+        self.atol = kwargs.get('atol', 0.05)              # Absolute temperature error per step (K)
+        self.rtol = kwargs.get('rtol', 1.0E-3)            # Relative temperature error per step
+        self.min_step = kwargs.get('min_step', 1.0E-3)    # Adaptive step limits in seconds
+        self.max_step = kwargs.get('max_step', 600.)
+        self.newton_tol = kwargs.get('newton_tol', 1.0E-6)   # Newton convergence on temperature (K)
+        self.newton_iter = kwargs.get('newton_iter', 20)
+        self.newton_rate = kwargs.get('newton_rate', 0.5)    # Refactorise if a correction shrinks by less than this
+        self.lu_ratio = kwargs.get('lu_ratio', 1.5)          # Reuse the LU while h is within this factor of its h
+        self.lu, self.lu_h = None, None                      # Sparse LU kept for modified Newton
+        self.n_factorisations = 0
+        self.enthalpy = kwargs.get('enthalpy', False)     # Integrate the node enthalpy, see Table.invert_integral
+        self.n_steps, self.n_rejected = 0, 0
+        self.n_power_evals, self.n_jacobian_evals, self.n_capacity_evals = 0, 0, 0
+        self.stop_time, self.stop_condition = None, None
+        return
+
+    def get_n_interps(self):
+        """ Number of material table interpolations made so far. """
+        network = self.network
+        n_edge_interps = 2 * len(network.con_from) + len(network.cooler_nodes)
+        return ((self.n_power_evals + self.n_jacobian_evals) * n_edge_interps +
+                self.n_capacity_evals * network.n_nodes)
+
+    def run(self, temps, run_time, delta_time, recorder, profiler=None, stop=None, **kwargs):
+        """ Integrate the network from temperatures temps for run_time seconds, starting with a tick of
+        delta_time, and return the final temperatures.  Each sample passed to the Recorder holds the time at the
+        start of a step, the node temperatures at the end of the step and the edge powers at the start of the
+        step (the convention used by Thermal.run_objects).  An optional Profiler times the 'powers', 'update',
+        'error' and 'record' phases.  The run ends early when any of the StopConditions (see stop.py) in the
+        list 'stop' is met, setting stop_time and stop_condition.
+
+        A Checkpoint (see checkpoint.py) passed as 'checkpoint' is written periodically.  To continue from a
+        checkpoint pass its state as 'resume', in which case temps and delta_time are taken from the state and
+        the run continues to the (absolute) time run_time.  The checkpoint nodes must have the names of the
+        network nodes, unless fork=True, when they are matched by position so that a node may be renamed (eg a
+        cooler node, which is named after its coolers.csv curve).
+        """
+        network = self.network
+        checkpoint = kwargs.get('checkpoint', None)
+        resume = kwargs.get('resume', None)
+        fork = kwargs.get('fork', False)            # Resume onto a changed model, matching nodes by position
+        time, step = 0., delta_time
+        temps_prev, step_prev = None, None
+        if resume is not None:
+            if fork and len(resume['names']) != network.n_nodes:
+                raise ValueError("The checkpoint has {:d} nodes, the network {:d}".format(len(resume['names']),
+                                                                                         network.n_nodes))
+            if not fork and resume['names'] != list(network.names):
+                raise ValueError("The checkpoint nodes do not match the network, use fork=True to match them by "
+                                 "position")
+            time, step, temps = resume['time'], resume['step'], np.array(resume['temps'])
+            temps_prev, step_prev = resume['temps_prev'], resume['step_prev']
+            self.strap_temps = resume.get('strap_temps', None)
+            if self.strap_temps is not None and (self.straps is None or
+                                                 self.strap_temps.shape[-2:] != self.straps.mask.shape):
+                raise ValueError("The checkpoint meshed conductors do not match the network")
+        if self.straps is not None and self.strap_temps is None:
+            self.strap_temps = self.straps.get_initial_temperatures(temps)
+        n_interps = self.get_n_interps()
+        stop = [] if stop is None else stop
+        for condition in stop:
+            condition.bind(network.names)
+        if profiler is not None:
+            profiler.start()
+        n_ticks = None if self.adaptive else len(np.arange(time, run_time, step))    # Counted as in run_objects
+        start_time, tick = time, 0
+        while time < run_time if n_ticks is None else tick < n_ticks:
+            if self.adaptive:
+                step = min(step, run_time - time)
+            node_powers, con_powers, rad_powers = network.get_powers(temps, sparse=self.sparse)
+            self.n_power_evals += 1
+            sources, source_jacobian = None, None
+            if self.straps is not None:
+                self.straps.linearise(temps, self.strap_temps, step)
+                sources = self.straps.get_node_powers(*self.straps.get_powers(np.zeros(np.shape(temps))))
+                node_powers = node_powers + sources
+                if self.method != 'euler':              # Implicit in the end node temperatures
+                    source_jacobian = self.straps.get_jacobian(sparse=self.sparse)
+            if profiler is not None:
+                profiler.lap('powers')
+            new_temps = self.step(temps, node_powers, step, temps_prev, step_prev, sources, source_jacobian)
+            if profiler is not None:
+                profiler.lap('update')
+            if self.adaptive:
+                error = self.get_error(temps, node_powers, new_temps, step, sources, source_jacobian)
+                if profiler is not None:
+                    profiler.lap('error')
+                factor = min(5., max(0.2, 0.9 / np.sqrt(max(error, 1.0E-10))))
+                if new_temps is None or error > 1.:
+                    self.n_rejected += 1
+                    step = step * factor
+                    if step < self.min_step:
+                        raise RuntimeError("Integrator step fell below {:.1e} s at t={:.1f} s".format(
+                            self.min_step, time))
+                    continue
+            elif new_temps is None:
+                raise RuntimeError("Newton iteration failed to converge at t={:.1f} s, "
+                                   "try a smaller tick or adaptive=True".format(time))
+            if self.straps is not None:
+                changes = np.zeros(np.shape(temps)) if source_jacobian is None else new_temps - temps
+                if self.method == 'exponential':    # The nodes exchanged heat at their mean over the step
+                    changes = self.exponential.get_mean_changes(node_powers)
+                con_powers[..., self.straps.cons], _ = self.straps.get_powers(changes)
+                new_strap_temps = self.straps.get_new_temperatures(self.strap_temps, changes)
+            recorder.record(time, new_temps, con_powers, rad_powers)
+            if profiler is not None:
+                profiler.lap('record')
+                profiler.end_tick(time, self.get_n_interps() - n_interps)
+                n_interps = self.get_n_interps()
+            self.n_steps += 1
+            if self.straps is not None:
+                self.strap_temps = new_strap_temps
+            for condition in stop:
+                stop_time = condition.check(time, step, temps, new_temps, node_powers)
+                if stop_time is not None:
+                    self.stop_time, self.stop_condition = stop_time, condition
+                    return new_temps
+            temps_prev, step_prev = temps, step
+            temps = new_temps
+            tick += 1
+            time = time + step if n_ticks is None else start_time + tick * step     # No summed round-off
+            if self.adaptive:
+                step = min(step * factor, self.max_step)
+                if self.sparse:                     # Keep to steps of lu_ratio^k s, so that the LU stays valid
+                    step = self.lu_ratio**np.floor(np.log(step) / np.log(self.lu_ratio) + 1.0E-9)
+            if checkpoint is not None and checkpoint.is_due(time):
+                checkpoint.write(self.compiled, recorder, {'time': time, 'step': step, 'temps': temps,
+                                                           'temps_prev': temps_prev, 'step_prev': step_prev,
+                                                           'strap_temps': self.strap_temps})
+        return temps
+
+    def step(self, temps, node_powers, step, temps_prev=None, step_prev=None, sources=None, source_jacobian=None):
+        """ Advance temps by one step, returning None if the implicit solution did not converge.  sources are
+        node powers from the straps (included in node_powers), which change by source_jacobian times the change
+        of temps over the step, or are held fixed if it is None.
+        """
+        network = self.network
+        self.n_capacity_evals += 1
+        if self.method == 'euler':
+            return network.find_new_temperatures(temps, node_powers, step, enthalpy=self.enthalpy)
+        if self.method == 'multirate':
+            return self.multirate.step(temps, step, enthalpy=self.enthalpy)
+        if self.method == 'exponential':
+            return self.exponential.step(temps, node_powers, step, source_jacobian)
+        if self.enthalpy:
+            states, heat_caps = network.get_enthalpies(temps), None
+            states_prev = None if temps_prev is None else network.get_enthalpies(temps_prev)
+        else:
+            heat_caps = network.masses * network.get_capacities(temps)     # Capacity is frozen over the step
+            states, states_prev = temps, temps_prev
+        if self.method == 'bdf2' and temps_prev is not None:
+            omega = step / step_prev
+            a = (1. + omega)**2 / (1. + 2. * omega)
+            b = omega**2 / (1. + 2. * omega)
+            c = (1. + omega) / (1. + 2. * omega)
+            history, h = a * states - b * states_prev, c * step
+        else:
+            history, h = states, step
+        return self.solve_newton(history, heat_caps, h, temps, sources, source_jacobian)
+
+    def solve_newton(self, history, heat_caps, h, guess, sources=None, source_jacobian=None):
+        """ Solve heat_caps * (T - history) = h * P(T) for T by Newton iteration.  If heat_caps is None,
+        history holds node enthalpies and masses * (H(T) - history) = h * P(T) is solved instead.  The strap
+        sources are linear about the temperatures guess (see step).
+        """
+        network = self.network
+        new_temps = guess.copy()
+        enthalpy = heat_caps is None
+        reused = (self.sparse and self.lu is not None and
+                  1. / self.lu_ratio <= h / self.lu_h <= self.lu_ratio)
+        stalled, last_size = not reused, None
+        for i in range(0, self.newton_iter):
+            node_powers, _, _ = network.get_powers(new_temps, sparse=self.sparse)
+            if sources is not None:
+                node_powers = node_powers + self.get_sources(sources, source_jacobian, guess, new_temps)
+            self.n_power_evals += 1
+            if enthalpy:
+                self.n_capacity_evals += 1
+                heat_caps = network.masses * network.get_capacities(new_temps)
+                residual = network.masses * (network.get_enthalpies(new_temps) - history) - h * node_powers
+            else:
+                residual = heat_caps * (new_temps - history) - h * node_powers
+            if self.sparse:
+                if stalled:
+                    self.factorise(heat_caps, h, new_temps, source_jacobian)
+                    stalled = False
+                delta = self.lu.solve(-residual)
+            else:
+                self.n_jacobian_evals += 1
+                jacobian = network.get_jacobian(new_temps)
+                if source_jacobian is not None:
+                    jacobian = jacobian + source_jacobian
+                jacobian = heat_caps[..., np.newaxis] * np.eye(network.n_nodes) - h * jacobian
+                delta = np.linalg.solve(jacobian, -residual[..., np.newaxis])[..., 0]
+            new_temps = new_temps + delta
+            if not np.all(np.isfinite(new_temps)) or np.any(new_temps <= 0.):
+                break
+            size = np.max(np.abs(delta))
+            if size < self.newton_tol:
+                return new_temps
+            stalled = last_size is not None and size > self.newton_rate * last_size
+            last_size = size
+        if reused:                          # Try again with a fresh factorisation before giving up
+            self.lu = None
+            return self.solve_newton(history, None if enthalpy else heat_caps, h, guess, sources, source_jacobian)
+        return None
+
+    def factorise(self, heat_caps, h, temps, source_jacobian=None):
+        """ Sparse LU factorisation of the Newton matrix heat_caps - h * J(temps), kept in self.lu. """
+        self.n_jacobian_evals += 1
+        self.n_factorisations += 1
+        jacobian = self.network.get_jacobian(temps, sparse=True)
+        if source_jacobian is not None:
+            jacobian = jacobian + source_jacobian
+        jacobian = scipy_sparse.diags(heat_caps, format='csc') - h * jacobian.tocsc()
+        self.lu, self.lu_h = scipy_linalg.splu(jacobian, permc_spec='MMD_AT_PLUS_A'), h
+        return
+
+    def get_sources(self, sources, source_jacobian, temps, new_temps):
+        """ Strap node powers with the nodes at new_temps, linear in their change from temps. """
+        if source_jacobian is None:
+            return sources
+        if self.sparse:
+            return sources + source_jacobian @ (new_temps - temps)
+        return sources + (source_jacobian @ (new_temps - temps)[..., np.newaxis])[..., 0]
+
+    def get_error(self, temps, node_powers, new_temps, step, sources=None, source_jacobian=None):
+        """ Local error estimate, normalised so that values below 1 are acceptable.  Uses the difference
+        between the first order step and a trapezoidal step, 0.5 * dt * |dT/dt(new) - dT/dt(old)|.
+        """
+        if new_temps is None:
+            return np.inf
+        network = self.network
+        new_powers, _, _ = network.get_powers(new_temps, sparse=self.sparse)
+        if sources is not None:
+            new_powers = new_powers + self.get_sources(sources, source_jacobian, temps, new_temps)
+        self.n_power_evals += 1
+        self.n_capacity_evals += 2
+        rate_old = node_powers / (network.masses * network.get_capacities(temps))
+        rate_new = new_powers / (network.masses * network.get_capacities(new_temps))
+        error = 0.5 * step * np.abs(rate_new - rate_old)
+        scale = self.atol + self.rtol * np.abs(new_temps)
+        return float(np.max(error / scale))
@@ -0,0 +1,121 @@
+#!/usr/bin/python
+import hashlib
+from capacitor import Capacitor
+from conductor import Conductor
+from radiator import Radiator
+from enclosure import Enclosure
+from cooler import Cooler
+from network import Network
+
+
+class Loader:
+    """ Reads model files ./data/<model_name>.csv into element objects, resolving the capacitors named by each
+    conductor and radiator through a name -> capacitor dictionary.  Compiled networks are cached in
+    ./data/<model_name>.npz, keyed by a hash of the model and material files.
+
+    A conductor line may end with three optional fields, segments, mass (kg) and heat capacity material, to mesh
+    it into segments which carry heat capacity (see strap.py), eg.
+
+        con, det_link, Cu_RRR=100, .170, 4.E-5, link_joint; block, 10, 0.05, Cu(OFHC)
+
+    A radiative enclosure (see enclosure.py) lists the emissivity and area of each of its surfaces and the
+    capacitors they belong to, followed by one 'vf' line for each row of its view factor matrix, eg.
+
+        enc, cold_box, .1; .1; .05, .05; .05; .02, steelblue, rs_front; rs_rear_cover; block
+        vf, cold_box, 0.; .4; .2
+        vf, cold_box, .4; 0.; .2
+        vf, cold_box, .5; .5; 0.
+    """
+
+    cache_version = '4'
+    material_files = ['capacity.csv', 'conductivity.csv', 'coolers.csv']
+
+    def __init__(self):
+        return
+
+    @staticmethod
+    def read_model(model_name):
+        """ Parse a model file, returning the lists of capacitors (including coolers), conductors, radiators and
+        enclosures.
+        """
+        path = './data/' + model_name + '.csv'
+        capacitors, conductors, radiators, enclosures = [], [], [], []
+        index, enclosure_index = {}, {}
+        with open(path, 'r') as text_file:
+            records = text_file.read().splitlines()
+        for line_no, record in enumerate(records, start=1):
+            tokens = tuple([t.strip() for t in record.split(',')])
+            tok0 = tokens[0]
+            if len(tok0) < 1 or '#' in tok0:
+                continue
+            where = "{:s} line {:d}".format(path, line_no)
+            if 'cap' in tok0 or 'coo' in tok0:
+                capacitor = Capacitor(tokens[1:6]) if 'cap' in tok0 else Cooler(tokens[1:6])
+                if capacitor.name in index:
+                    raise ValueError("{:s}: duplicate capacitor name {:s}".format(where, capacitor.name))
+                index[capacitor.name] = capacitor
+                capacitors.append(capacitor)
+            if 'con' in tok0:
+                caps = Loader._find_capacitors(tokens[5], index, where)
+                conductors.append(Conductor(tokens[1:6], caps, **Loader._get_mesh(tokens, where)))
+            if 'rad' in tok0:
+                caps = Loader._find_capacitors(tokens[5], index, where)
+                radiators.append(Radiator(tokens[1:5], caps))
+            if 'enc' in tok0:
+                caps = Loader._find_capacitors(tokens[5], index, where, n_caps=None)
+                enclosure = Enclosure(tokens[1:5], caps)
+                enclosure_index[enclosure.name] = enclosure
+                enclosures.append(enclosure)
+            if tok0 == 'vf':
+                if tokens[1] not in enclosure_index:
+                    raise ValueError("{:s}: view factors for unknown enclosure '{:s}'".format(where, tokens[1]))
+                enclosure_index[tokens[1]].add_view_factors(tokens[2].split(';'))
+        return capacitors, conductors, radiators, enclosures
+
+    @staticmethod
+    def _find_capacitors(token, index, where, n_caps=2):
+        """ Capacitors named in a ';' separated token, n_caps of them or, if n_caps is None, at least two. """
+        cap_names = [cap_name.strip() for cap_name in token.split(';')]
+        if n_caps is not None and len(cap_names) != n_caps:
+            raise ValueError("{:s}: expected {:d} capacitor names, found '{:s}'".format(where, n_caps, token))
+        if len(cap_names) < 2:
+            raise ValueError("{:s}: expected at least two capacitor names, found '{:s}'".format(where, token))
+        for cap_name in cap_names:
+            if cap_name not in index:
+                raise ValueError("{:s}: unknown capacitor '{:s}'".format(where, cap_name))
+        return [index[cap_name] for cap_name in cap_names]
+
+    @staticmethod
+    def _get_mesh(tokens, where):
+        """ Optional segments, mass and capacity material of a meshed conductor. """
+        if len(tokens) < 7 or len(tokens[6]) == 0:
+            return {}
+        if len(tokens) < 9:
+            raise ValueError("{:s}: a meshed conductor needs segments, mass and capacity material".format(where))
+        return {'segments': int(tokens[6]), 'mass': float(tokens[7]), 'capacity_material': tokens[8]}
+
+    @staticmethod
+    def get_key(model_name):
+        """ Hash of the model file and material data, identifying a compiled network. """
+        sha = hashlib.sha1(Loader.cache_version.encode())
+        paths = ['./data/' + model_name + '.csv'] + ['./materials/' + name for name in Loader.material_files]
+        for path in paths:
+            with open(path, 'rb') as data_file:
+                sha.update(data_file.read())
+        return sha.hexdigest()
+
+    @staticmethod
+    def load_network(model_name, elements=None):
+        """ Return the compiled Network for a model, from the cache if it is up to date.  Otherwise it is compiled
+        from elements, the lists returned by read_model if the caller has already parsed the model, and cached.
+        """
+        Capacitor.load_data()
+        Conductor.load_data()
+        Cooler.load_data()
+        key = Loader.get_key(model_name)
+        cache_path = './data/' + model_name + '.npz'
+        network = Network.read(cache_path, key)
+        if network is None:
+            network = Network(*(Loader.read_model(model_name) if elements is None else elements))
+            network.save(cache_path, key)
+        return network
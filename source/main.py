@@ -1,8 +1,102 @@
 #!/usr/bin/python
+import sys
+import logging
+import argparse
 from thermal import Thermal
+from integrator import Integrator
+from profiler import Profiler
+from stop import Threshold, SteadyState
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Time dependent thermal model.  Run from the repository root.')
+    parser.add_argument('model', nargs='?', default='marvel', help='model name, read from ./data/<model>.csv')
+    parser.add_argument('--run-time', type=float, default=3600., help='simulated time in seconds')
+    parser.add_argument('--tick', type=float, default=1., help='model tick (initial tick if adaptive) in seconds')
+    parser.add_argument('--mode', choices=['object', 'network'], default='object',
+                        help="'network' (compiled arrays) is needed by the options marked (network mode)")
+    parser.add_argument('--integrator', choices=Integrator.methods, default='euler', help='(network mode)')
+    parser.add_argument('--adaptive', action='store_true', help='use an error controlled adaptive tick (network mode)')
+    parser.add_argument('--enthalpy', action='store_true', help='exact enthalpy based node update (network mode)')
+    parser.add_argument('--reduce', type=float, default=None, metavar='RATIO',
+                        help='merge capacitors which relax within RATIO ticks of each other before the run')
+    parser.add_argument('--reduce-drop', type=float, default=0.1, metavar='KELVIN',
+                        help='only merge capacitors within KELVIN of each other in the steady state')
+    parser.add_argument('--record-interval', type=float, default=0., help='minimum seconds between samples')
+    parser.add_argument('--output', default=None,
+                        help='stream results to this directory (memory mapped) or .h5 file (HDF5)')
+    parser.add_argument('--headless', action='store_true', help='no plots, matplotlib is not imported')
+    parser.add_argument('--steady-state', action='store_true', help='also solve for the equilibrium temperatures')
+    parser.add_argument('--stop-below', nargs=2, action='append', default=[], metavar=('NAME', 'TEMP'),
+                        help='stop the run when capacitor NAME cools to TEMP kelvin (may be repeated)')
+    parser.add_argument('--stop-steady', type=float, default=None, metavar='RATE',
+                        help='stop the run when no capacitor changes faster than RATE K/s')
+    parser.add_argument('--stop-ignore', action='append', default=None, metavar='NAME',
+                        help='leave capacitor NAME out of --stop-steady (may be repeated), by default the boundary '
+                        'capacitors of at least {:.0f} kg are left out'.format(Thermal.boundary_mass))
+    parser.add_argument('--checkpoint', default=None, help='write a checkpoint to this .npz file during the run '
+                        '(network mode)')
+    parser.add_argument('--checkpoint-interval', type=float, default=3600., help='simulated seconds between '
+                        'checkpoints')
+    parser.add_argument('--resume', default=None, help='continue from this checkpoint to --run-time (network mode)')
+    parser.add_argument('--fork', action='store_true', help='allow --resume onto a changed model')
+    parser.add_argument('--cache', action='store_true', help='reuse the stored results of identical runs, kept '
+                        'in ./data/results')
+    parser.add_argument('--profile', action='store_true', help='log the time spent in each phase')
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    args = parser.parse_args(argv)
+    network_only = {'--integrator': args.integrator != 'euler', '--adaptive': args.adaptive,
+                    '--enthalpy': args.enthalpy, '--checkpoint': args.checkpoint is not None,
+                    '--resume': args.resume is not None}
+    for option, is_set in network_only.items():
+        if is_set and args.mode != 'network':
+            parser.error("{:s} needs --mode network".format(option))
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    log = logging.getLogger('main')
+    plot = not args.headless
+    profiler = Profiler() if args.profile else None
+    sink = None
+    if args.output is not None:
+        from sink import MemmapSink, Hdf5Sink       # Only import h5py when results are written
+        sink = Hdf5Sink(args.output) if args.output.endswith('.h5') else MemmapSink(args.output)
+
+    cache = None
+    if args.cache:
+        from cache import ResultCache
+        cache = ResultCache()
+    thermal = Thermal()
+    thermal.load_model(args.model, plot=plot, profiler=profiler)
+    stop = [Threshold(name, float(temp)) for name, temp in args.stop_below]
+    if args.stop_steady is not None:
+        ignore = args.stop_ignore
+        if ignore is None:                          # Heavy boundary nodes drift slowly for days
+            ignore = [cap.name for cap in thermal.capacitors if cap.mass >= Thermal.boundary_mass]
+        stop.append(SteadyState(args.stop_steady, ignore=ignore))
+    if args.steady_state:
+        for name, temp in thermal.solve_steady_state().items():
+            log.info("Steady state {:s} {:.2f} K".format(name, temp))
+    recorder = thermal.run(mode=args.mode, run_time=args.run_time, delta_time=args.tick,
+                           integrator=args.integrator, adaptive=args.adaptive, enthalpy=args.enthalpy,
+                           record_interval=args.record_interval, sink=sink, plot=plot, profiler=profiler, stop=stop,
+                           checkpoint=args.checkpoint, checkpoint_interval=args.checkpoint_interval,
+                           resume=args.resume, fork=args.fork, cache=cache, reduce=args.reduce,
+                           reduce_drop=args.reduce_drop)
+    for capacitor in thermal.capacitors:
+        log.info("Final {:s} {:.2f} K".format(capacitor.name, capacitor.temperature))
+    if sink is not None:
+        log.info('Results written to ' + args.output)
+    else:
+        log.info("Recorded {:d} samples".format(recorder.n_samples))
+    if profiler is not None:
+        log.info(str(profiler))
+    return 0
+
 
 # Press the green button in the gutter to run the script.
 if __name__ == '__main__':
-    thermal = Thermal()
-    thermal.load_model('marvel')
-    thermal.run()
+    sys.exit(main())
@@ -0,0 +1,218 @@
+#!/usr/bin/python
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from table import Table
+from capacitor import Capacitor
+from conductor import Conductor
+from cooler import Cooler
+from integrator import Integrator
+from recorder import Recorder
+
+_worker = {}        # Network and shared table memory held by each worker process
+
+
+def _init_worker(network, table_specs):
+    """ Attach the worker to the material tables in shared memory. """
+    blocks = []
+    for cls, (shm_name, names, t_min, step, shape) in zip([Capacitor, Conductor, Cooler], table_specs):
+        shm = shared_memory.SharedMemory(name=shm_name)
+        values = np.ndarray(shape, dtype=float, buffer=shm.buf)
+        values.flags.writeable = False
+        cls.table = Table.from_values(names, t_min, step, values)
+        blocks.append(shm)
+    _worker['network'], _worker['blocks'] = network, blocks
+    return
+
+
+def _run_chunk(first, fields, run_time, delta_time, times, target_nodes, target_temps, kwargs):
+    """ Run one chunk of samples as a batch, returning their temperatures on the common time grid, with shape
+    (n_times, n_chunk, n_nodes), and the time each target node first reached its target temperature.
+    """
+    network = _worker['network'].replace(**fields)
+    n_chunk = len(next(iter(fields.values())))
+    recorder = Recorder(network.names, network.con_names, network.rad_names, interval=0.,
+                        n_samples=int(run_time / delta_time) + 1, n_variants=n_chunk)
+    temps = np.array(np.broadcast_to(network.temperatures, (n_chunk, network.n_nodes)))
+    Integrator(network, **kwargs).run(temps, run_time, delta_time, recorder)
+    n = recorder.n_samples
+    samples, history = recorder.times[0:n], recorder.temps[0:n]
+    grid_temps = np.empty((len(times), n_chunk, network.n_nodes))
+    for i in range(0, n_chunk):
+        for j in range(0, network.n_nodes):
+            grid_temps[:, i, j] = np.interp(times, samples, history[:, i, j])
+    crossings = MonteCarlo.get_crossing_times(samples, history[:, :, target_nodes], target_temps)
+    return first, grid_temps, crossings
+
+
+class MonteCarlo:
+    """ Uncertainty analysis by Monte Carlo.  Model parameters are perturbed by random factors and the runs
+    are spread over a ProcessPoolExecutor, each task running a chunk of samples as one batched network (see
+    sweep.py).  The material tables are placed in shared memory once, so the workers don't re-read the csv
+    files.  The distributions are a dictionary keyed by '<parameter>:<element>' (element '*' selects all
+    elements of that kind) of multiplicative factors, ('normal', sigma), ('lognormal', sigma) or
+    ('uniform', low, high), eg.
+
+        {'capacity:Cu(OFHC)': ('normal', 0.1), 'mass:*': ('normal', 0.03), 'emissivity:*': ('uniform', .5, 1.5)}
+
+    Parameters are 'mass' (capacitor), 'capacity' (capacitor material), 'conductivity' (conductor material),
+    'area_length' (conductor), 'emissivity' and 'area' (radiator).  A capacity factor scales the heat
+    capacity, and so the mass, of every node of that material, and a conductivity factor scales the A/L of
+    every conductor of that material.
+    """
+
+    parameters = {'mass': ('masses', 'names'),
+                  'capacity': ('masses', 'material_ids'),
+                  'conductivity': ('con_area_length', 'con_material_ids'),
+                  'area_length': ('con_area_length', 'con_element_names'),
+                  'emissivity': ('rad_emissivity', 'rad_element_names'),
+                  'area': ('rad_area', 'rad_element_names')}
+
+    def __init__(self, network, distributions, **kwargs):
+        self.network = network
+        self.distributions = distributions
+        self.n_runs = kwargs.get('n_runs', 100)
+        self.seed = kwargs.get('seed', 0)
+        self.chunk = kwargs.get('chunk', 8)                 # Samples per task, run together as one batch
+        self.max_workers = kwargs.get('max_workers', None)  # Default is all cores
+        self.percentiles = kwargs.get('percentiles', [5., 50., 95.])
+        self.factors = None
+        return
+
+    def _select(self, parameter, element):
+        """ Boolean mask of the columns of a network field selected by '<parameter>:<element>'. """
+        network = self.network
+        field, name_field = MonteCarlo.parameters[parameter]
+        if name_field == 'material_ids':
+            table = Capacitor.table
+        elif name_field == 'con_material_ids':
+            table = Conductor.table
+        else:
+            table = None
+        names = getattr(network, name_field)
+        if table is not None:
+            names = [table.names[i] for i in names]
+        mask = np.array([element == '*' or name == element for name in names], dtype=bool)
+        if not np.any(mask):
+            raise ValueError("No element {:s} in the model to perturb {:s}".format(element, parameter))
+        return field, mask
+
+    def sample(self):
+        """ Draw the random factors of every run, returning the perturbed network field arrays, each of shape
+        (n_runs, n_columns).  The factors are kept in self.factors.
+        """
+        rng = np.random.default_rng(self.seed)
+        fields, self.factors = {}, {}
+        for key, distribution in self.distributions.items():
+            tokens = key.split(':')
+            if len(tokens) != 2 or tokens[0] not in MonteCarlo.parameters:
+                raise ValueError("Distribution key {:s} is not '<parameter>:<element>' with parameter one of "
+                                 "{:s}".format(key, str(list(MonteCarlo.parameters.keys()))))
+            field, mask = self._select(tokens[0], tokens[1])
+            kind = distribution[0]
+            if kind == 'normal':
+                factors = 1. + distribution[1] * rng.standard_normal(self.n_runs)
+            elif kind == 'lognormal':
+                factors = np.exp(distribution[1] * rng.standard_normal(self.n_runs))
+            elif kind == 'uniform':
+                factors = rng.uniform(distribution[1], distribution[2], self.n_runs)
+            else:
+                raise ValueError("Unknown distribution {:s}".format(str(kind)))
+            if field not in fields:
+                fields[field] = np.tile(getattr(self.network, field), (self.n_runs, 1))
+            fields[field][:, mask] *= factors[:, np.newaxis]
+            self.factors[key] = factors
+        return fields
+
+    @staticmethod
+    def get_crossing_times(times, series, targets):
+        """ Time at which each history in series, of shape (n_samples, ...), first falls to its target,
+        interpolated between samples, or nan if it never does.
+        """
+        below = series <= targets
+        reached = np.any(below, axis=0)
+        k = np.argmax(below, axis=0)
+        km = np.maximum(k - 1, 0)
+        s0 = np.take_along_axis(series, km[np.newaxis], axis=0)[0]
+        s1 = np.take_along_axis(series, k[np.newaxis], axis=0)[0]
+        drop = np.where(s0 > s1, s0 - s1, 1.)
+        frac = np.where(k > 0, np.clip((s0 - targets) / drop, 0., 1.), 1.)
+        crossings = times[km] + frac * (times[k] - times[km])
+        return np.where(reached, crossings, np.nan)
+
+    def run(self, run_time, delta_time, **kwargs):
+        """ Run all the samples, returning a dictionary of results, 'times' (the record_interval grid),
+        'envelopes' (temperature percentiles of each node, shape (n_percentiles, n_times)) and, for each node
+        in the targets dictionary {name: temperature}, its 'time_to_target' in every run and their
+        percentiles.  An optional callback(n_done, results) is passed the statistics of the runs completed so
+        far as each chunk finishes.  Other kwargs are passed to Integrator (dense backend).
+        """
+        record_interval = kwargs.pop('record_interval', 60.)   # Spacing of the envelope time grid (s)
+        targets = kwargs.pop('targets', {})
+        callback = kwargs.pop('callback', None)
+        network = self.network
+        fields = self.sample()
+        times = np.arange(0., run_time + 0.5 * record_interval, record_interval)
+        target_nodes = np.array([network.names.index(name) for name in targets], dtype=int)
+        target_temps = np.array([targets[name] for name in targets], dtype=float)
+
+        all_temps = np.full((len(times), self.n_runs, network.n_nodes), np.nan)
+        crossings = np.full((self.n_runs, len(target_nodes)), np.nan)
+        blocks = MonteCarlo._share_tables()
+        specs = [spec for _, spec in blocks]
+        n_done = 0
+        try:
+            with ProcessPoolExecutor(max_workers=self.max_workers or os.cpu_count(), initializer=_init_worker,
+                                     initargs=(network, specs)) as pool:
+                futures = []
+                for first in range(0, self.n_runs, self.chunk):
+                    last = min(first + self.chunk, self.n_runs)
+                    chunk_fields = {field: values[first:last] for field, values in fields.items()}
+                    futures.append(pool.submit(_run_chunk, first, chunk_fields, run_time, delta_time, times,
+                                               target_nodes, target_temps, kwargs))
+                for future in as_completed(futures):
+                    first, grid_temps, chunk_crossings = future.result()
+                    last = first + grid_temps.shape[1]
+                    all_temps[:, first:last] = grid_temps
+                    crossings[first:last] = chunk_crossings
+                    n_done += grid_temps.shape[1]
+                    if callback is not None:
+                        callback(n_done, self.get_statistics(times, all_temps, crossings, targets))
+        finally:
+            for shm, _ in blocks:
+                shm.close()
+                shm.unlink()
+        results = self.get_statistics(times, all_temps, crossings, targets)
+        return results
+
+    def get_statistics(self, times, all_temps, crossings, targets):
+        """ Percentile envelopes and time to target over the runs completed so far (those without nans). """
+        done = np.logical_not(np.isnan(all_temps[0, :, 0]))
+        envelopes = {}
+        for j, name in enumerate(self.network.names):
+            envelopes[name] = np.percentile(all_temps[:, done, j], self.percentiles, axis=1)
+        time_to_target, target_percentiles = {}, {}
+        for j, name in enumerate(targets):
+            time_to_target[name] = crossings[done, j]
+            reached = time_to_target[name][np.isfinite(time_to_target[name])]
+            target_percentiles[name] = np.percentile(reached, self.percentiles) if len(reached) > 0 else None
+        return {'n_runs': int(np.sum(done)), 'times': times, 'percentiles': self.percentiles,
+                'envelopes': envelopes, 'time_to_target': time_to_target,
+                'time_to_target_percentiles': target_percentiles}
+
+    @staticmethod
+    def _share_tables():
+        """ Copy the capacity, conductivity and cooler tables into shared memory blocks, returning each block
+        with the spec a worker needs to attach to it.
+        """
+        Capacitor.load_data()
+        Conductor.load_data()
+        Cooler.load_data()
+        blocks = []
+        for table in [Capacitor.table, Conductor.table, Cooler.table]:
+            shm = shared_memory.SharedMemory(create=True, size=table.values.nbytes)
+            values = np.ndarray(table.values.shape, dtype=float, buffer=shm.buf)
+            values[:] = table.values
+            blocks.append((shm, (shm.name, table.names, table.t_min, table.step, table.values.shape)))
+        return blocks
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+import numpy as np
+from capacitor import Capacitor
+
+
+class MultiRate:
+    """ Explicit multi-rate stepping of a compiled Network.  Each node is given a level l from its local time
+    constant tau = m c(T) / G, G being the sum of the conductances (W/K) attached to it, such that its substep
+    h_l = step / 2^l is no longer than safety * tau.  Light nodes on stiff straps are then subcycled while the
+    heavy nodes take the full step.
+
+    Every edge (conductor, radiator, cooler or enclosure) is evaluated at the rate of the faster of its nodes,
+    using the current temperature of the slower node, which is held until the end of its own substep.  The heat
+    of every edge evaluation, power * h, is added to the heat accumulated by both of its nodes, each node taking
+    its accumulated heat when it completes a substep, so the heat exchanged between fast and slow nodes is
+    conserved exactly.  Meshed conductors (see strap.py) are not supported.
+    """
+
+    def __init__(self, network, **kwargs):
+        if np.any(network.con_segments > 1):
+            raise ValueError("Multi-rate stepping does not support meshed conductors")
+        self.network = network
+        self.safety = kwargs.get('safety', 0.5)         # Largest substep as a fraction of the node time constant
+        self.max_level = kwargs.get('max_level', 10)    # Finest substep is step / 2^max_level
+        self.levels = None
+        self.level_networks = {}
+        self.n_substeps = 0
+        return
+
+    def get_conductances(self, temps):
+        """ Total conductance (W/K) between every node and the rest of the network, at temperatures temps. """
+        network = self.network
+        k_from, k_to = network.get_kint_slopes(temps)
+        ga, gb = network.con_area_length * k_from, network.con_area_length * k_to
+        ta, tb = temps[..., network.rad_from], temps[..., network.rad_to]
+        ea_sigma = network.rad_emissivity * network.rad_area * network.sigma
+        ra, rb = 4. * ea_sigma * ta**3, 4. * ea_sigma * tb**3
+        conductances = network._scatter(network.con_from, ga) + network._scatter(network.con_to, gb)
+        conductances += network._scatter(network.rad_from, ra) + network._scatter(network.rad_to, rb)
+        conductances[..., network.cooler_nodes] += np.abs(network.get_cooler_slopes(temps))
+        if len(network.enc_nodes) > 0:
+            slopes = np.abs(np.diagonal(network._get_enclosure_slopes(temps), axis1=-2, axis2=-1))
+            conductances += network._scatter(network.enc_nodes, slopes)
+        return conductances
+
+    def get_levels(self, temps, step):
+        """ Subcycling level of every node for a step of the given length, shared by all variants of a batch. """
+        network = self.network
+        heat_caps = network.masses * network.get_capacities(temps)
+        taus = heat_caps / np.maximum(self.get_conductances(temps), 1.0E-30)
+        taus = np.min(taus.reshape(-1, network.n_nodes), axis=0)
+        levels = np.ceil(np.log2(np.maximum(step / (self.safety * taus), 1.)))
+        return np.minimum(levels, self.max_level).astype(int)
+
+    def _get_level_networks(self, levels):
+        """ For each level, the nodes at that level and a copy of the network holding only the edges at that
+        level, ie those whose faster node is at that level.
+        """
+        key = levels.tobytes()
+        if key in self.level_networks:
+            return self.level_networks[key]
+        network = self.network
+        con_levels = np.maximum(levels[network.con_from], levels[network.con_to])
+        rad_levels = np.maximum(levels[network.rad_from], levels[network.rad_to])
+        cooler_levels = levels[network.cooler_nodes]
+        enc_level = int(np.max(levels[network.enc_nodes], initial=0))
+        level_networks = []
+        for level in range(0, int(np.max(levels)) + 1):
+            cons, rads = np.flatnonzero(con_levels == level), np.flatnonzero(rad_levels == level)
+            coolers = np.flatnonzero(cooler_levels == level)
+            fields = {'con_from': network.con_from[cons], 'con_to': network.con_to[cons],
+                      'con_area_length': network.con_area_length[..., cons],
+                      'con_material_ids': network.con_material_ids[cons],
+                      'rad_from': network.rad_from[rads], 'rad_to': network.rad_to[rads],
+                      'rad_emissivity': network.rad_emissivity[..., rads], 'rad_area': network.rad_area[..., rads],
+                      'cooler_nodes': network.cooler_nodes[coolers],
+                      'cooler_ids': network.cooler_ids[..., coolers]}
+            if level != enc_level:
+                fields.update({'enc_nodes': np.zeros(0, dtype=int), 'enc_exchange': np.zeros((0, 0))})
+            n_edges = len(cons) + len(rads) + len(coolers) + (len(network.enc_nodes) if level == enc_level else 0)
+            edges = network.replace(**fields) if n_edges > 0 else None
+            level_networks.append((np.flatnonzero(levels == level), edges))
+        self.level_networks = {key: level_networks}         # Keep only the latest partition
+        return level_networks
+
+    def step(self, temps, step, enthalpy=False):
+        """ Advance temps by one (slow) step, subcycling the fast nodes. """
+        network = self.network
+        self.levels = self.get_levels(temps, step)
+        level_networks = self._get_level_networks(self.levels)
+        n_levels = len(level_networks)
+        n_micro = 2**(n_levels - 1)
+        temps = np.array(temps, dtype=float)
+        heats = np.zeros(temps.shape)
+        for k in range(0, n_micro):
+            for level, (nodes, edges) in enumerate(level_networks):
+                stride = 2**(n_levels - 1 - level)
+                if edges is not None and k % stride == 0:          # Start of a substep of this level
+                    heats += edges.get_powers(temps)[0] * (step / 2**level)
+                    self.n_substeps += 1
+            for level, (nodes, edges) in enumerate(level_networks):
+                stride = 2**(n_levels - 1 - level)
+                if (k + 1) % stride == 0 and len(nodes) > 0:      # End of a substep of this level
+                    temps[..., nodes] = self._update(nodes, temps[..., nodes], heats[..., nodes], enthalpy)
+                    heats[..., nodes] = 0.
+        return temps
+
+    def _update(self, nodes, temps, heats, enthalpy):
+        """ New temperatures of the given nodes after adding heats (J), as Network.find_new_temperatures. """
+        network = self.network
+        masses, material_ids = network.masses[..., nodes], network.material_ids[nodes]
+        if enthalpy:
+            enthalpies = Capacitor.table.evaluate_integral(material_ids, temps) + heats / masses
+            return Capacitor.table.invert_integral(material_ids, enthalpies)
+        return temps + heats / (masses * Capacitor.table.evaluate(material_ids, temps))
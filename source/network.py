@@ -0,0 +1,372 @@
+#!/usr/bin/python
+import os
+import zipfile
+import numpy as np
+try:
+    import scipy.sparse as scipy_sparse
+except ImportError:
+    scipy_sparse = None
+from capacitor import Capacitor
+from conductor import Conductor
+from cooler import Cooler
+
+
+class Network:
+    """ Compiled (struct-of-arrays) form of a thermal model.  Capacitors become node arrays, conductors and
+    radiators become edge arrays holding the indices of the nodes they connect, so that a model tick is a
+    handful of gather / scatter operations instead of a loop over Python objects.  A compiled network is
+    immutable, the node temperatures being held by the caller (eg an Integrator).
+
+    The power and Jacobian methods also accept temperatures of shape (n_variants, n_nodes), for a batch of
+    model variants made by replace() (see sweep.py), giving results with a leading variant axis.
+
+    Radiative enclosures (see enclosure.py) are held as the nodes of all their surfaces, enc_nodes, and one
+    block diagonal exchange matrix, so that their powers are one matrix-vector product on the surface T^4.
+
+    For large networks the powers and Jacobian can be formed from scipy.sparse incidence matrices (pass
+    sparse=True), so that memory and time scale with the number of edges rather than the square of the number
+    of nodes.
+    """
+
+    sigma = 5.6703744E-8                    # Stephan-Boltzmann constant W m-2 K-4
+    fields = ['names', 'masses', 'temperatures', 'material_ids', 'cooler_nodes', 'cooler_ids',
+              'con_names', 'con_element_names', 'con_from', 'con_to', 'con_area_length', 'con_material_ids',
+              'con_segments', 'con_masses', 'con_capacity_ids',
+              'rad_names', 'rad_element_names', 'rad_from', 'rad_to', 'rad_emissivity', 'rad_area',
+              'enc_names', 'enc_nodes', 'enc_exchange']
+
+    def __init__(self, capacitors, conductors, radiators, enclosures=()):
+        node_index = {id(cap): i for i, cap in enumerate(capacitors)}
+        self.names = [cap.name for cap in capacitors]
+        self.n_nodes = len(capacitors)
+        self.masses = np.array([cap.mass for cap in capacitors])
+        self.temperatures = np.array([cap.temperature for cap in capacitors])
+        self.material_ids = np.array([cap.material_id for cap in capacitors], dtype=int)
+
+        coolers = [cap for cap in capacitors if cap.is_cooler]
+        self.cooler_nodes = np.array([node_index[id(cap)] for cap in coolers], dtype=int)
+        self.cooler_ids = np.array([cap.cooler_id for cap in coolers], dtype=int)
+
+        self.con_names = [con.from_to_name for con in conductors]
+        self.con_element_names = [con.name for con in conductors]
+        self.con_from = np.array([node_index[id(con.capacitors[0])] for con in conductors], dtype=int)
+        self.con_to = np.array([node_index[id(con.capacitors[1])] for con in conductors], dtype=int)
+        self.con_area_length = np.array([con.xsarea_length for con in conductors])
+        self.con_material_ids = np.array([con.material_id for con in conductors], dtype=int)
+        self.con_segments = np.array([con.segments for con in conductors], dtype=int)     # > 1 is meshed, see Straps
+        self.con_masses = np.array([con.mass for con in conductors])
+        self.con_capacity_ids = np.array([con.capacity_id for con in conductors], dtype=int)
+
+        self.rad_names = [rad.from_to_name for rad in radiators]
+        self.rad_element_names = [rad.name for rad in radiators]
+        self.rad_from = np.array([node_index[id(rad.capacitors[0])] for rad in radiators], dtype=int)
+        self.rad_to = np.array([node_index[id(rad.capacitors[1])] for rad in radiators], dtype=int)
+        self.rad_emissivity = np.array([rad.emissivity for rad in radiators])
+        self.rad_area = np.array([rad.area for rad in radiators])
+
+        self.enc_names = [enc.name for enc in enclosures]
+        self.enc_nodes = np.array([node_index[id(cap)] for enc in enclosures for cap in enc.capacitors], dtype=int)
+        n_surfaces = len(self.enc_nodes)
+        self.enc_exchange = np.zeros((n_surfaces, n_surfaces))
+        start = 0
+        for enc in enclosures:
+            end = start + len(enc.capacitors)
+            self.enc_exchange[start:end, start:end] = enc.get_exchange()
+            start = end
+        self._cache = {}
+        self._freeze()
+        return
+
+    def _freeze(self):
+        for field in Network.fields:
+            value = getattr(self, field)
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+        self._frozen = True
+        return
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError("Network is immutable, can't set attribute " + name)
+        object.__setattr__(self, name, value)
+        return
+
+    def replace(self, **fields):
+        """ Return a copy of the network with the named fields replaced, eg masses=new_masses.  Giving a field
+        a leading variant axis, eg con_area_length of shape (n_variants, n_conductors), makes a batched network
+        which must be run with temperatures of shape (n_variants, n_nodes).
+        """
+        network = Network.__new__(Network)
+        for name, value in self.__dict__.items():
+            if name != '_frozen':
+                object.__setattr__(network, name, value)
+        for field, value in fields.items():
+            if field not in Network.fields:
+                raise ValueError("Unknown network field {:s}".format(field))
+            object.__setattr__(network, field, np.array(value))
+        object.__setattr__(network, '_cache', {})
+        network._freeze()
+        return network
+
+    def save(self, path, key):
+        """ Write the compiled network to a .npz file, tagged with key to identify the model version.  The file is
+        replaced atomically, so a reader never sees a partly written one.
+        """
+        arrays = {field: np.array(getattr(self, field)) for field in Network.fields}
+        tmp_path = "{:s}.{:d}.tmp.npz".format(path, os.getpid())
+        np.savez(tmp_path, key=np.array(key), **arrays)
+        os.replace(tmp_path, path)
+        return
+
+    @staticmethod
+    def read(path, key):
+        """ Read a network written by save, returning None if the file is missing, unreadable or has a different
+        key.
+        """
+        try:
+            with np.load(path, allow_pickle=False) as arrays:
+                if str(arrays['key']) != key:
+                    return None
+                network = Network.__new__(Network)
+                for field in Network.fields:
+                    value = arrays[field]
+                    value = [str(name) for name in value] if field.endswith('names') else value
+                    object.__setattr__(network, field, value)
+        except (OSError, EOFError, KeyError, ValueError, zipfile.BadZipFile):
+            return None
+        object.__setattr__(network, 'n_nodes', len(network.names))
+        object.__setattr__(network, '_cache', {})
+        network._freeze()
+        return network
+
+    def get_capacities(self, temps):
+        """ Specific heat capacity (J/kg/K) of every node at temperatures temps. """
+        return Capacitor.table.evaluate(self.material_ids, temps)
+
+    def get_kints(self, temps):
+        """ Integrated conductivity (W/m) at the 'from' and 'to' end of every conductor. """
+        if len(self.con_from) == 0:
+            empty = np.zeros(temps.shape[:-1] + (0,))
+            return empty, empty
+        table, ids = Conductor.table, self.con_material_ids
+        return table.evaluate(ids, temps[..., self.con_from]), table.evaluate(ids, temps[..., self.con_to])
+
+    def get_cooler_powers(self, temps):
+        """ Heat (W) extracted by each cooler at its current temperature. """
+        if len(self.cooler_nodes) == 0:
+            return np.zeros(temps.shape[:-1] + (0,))
+        return Cooler.table.evaluate(self.cooler_ids, temps[..., self.cooler_nodes])
+
+    def get_cooler_slopes(self, temps):
+        """ Rate of change of cooler power with temperature (W/K) for each cooler. """
+        if len(self.cooler_nodes) == 0:
+            return np.zeros(temps.shape[:-1] + (0,))
+        return Cooler.table.evaluate_slope(self.cooler_ids, temps[..., self.cooler_nodes])
+
+    def get_kint_slopes(self, temps):
+        """ Thermal conductivity (W/m/K), ie the slope of the integrated conductivity, at both ends of every
+        conductor.
+        """
+        if len(self.con_from) == 0:
+            empty = np.zeros(temps.shape[:-1] + (0,))
+            return empty, empty
+        table, ids = Conductor.table, self.con_material_ids
+        return table.evaluate_slope(ids, temps[..., self.con_from]), table.evaluate_slope(ids, temps[..., self.con_to])
+
+    def get_incidence(self):
+        """ Sparse (n_nodes, n_edges) incidence matrices of the conductors and radiators, with -1 at the 'from'
+        node and +1 at the 'to' node of each edge, so that net node power = incidence @ edge power.
+        """
+        if scipy_sparse is None:
+            raise ImportError("The sparse network backend needs scipy")
+        if 'incidence' not in self._cache:
+            matrices = []
+            for nodes_from, nodes_to in [(self.con_from, self.con_to), (self.rad_from, self.rad_to)]:
+                n_edges = len(nodes_from)
+                edges = np.arange(0, n_edges)
+                rows = np.concatenate((nodes_from, nodes_to))
+                cols = np.concatenate((edges, edges))
+                vals = np.concatenate((-np.ones(n_edges), np.ones(n_edges)))
+                matrices.append(scipy_sparse.csr_matrix((vals, (rows, cols)), shape=(self.n_nodes, n_edges)))
+            self._cache['incidence'] = tuple(matrices)
+        return self._cache['incidence']
+
+    def get_powers(self, temps, sparse=False):
+        """ Find the heat flow along every conductor and radiator (positive from 'from' to 'to' node) and the
+        resulting net power into every node, including heat lifted by coolers.
+        """
+        kt_from, kt_to = self.get_kints(temps)
+        con_powers = self.con_area_length * (kt_from - kt_to)
+        ta, tb = temps[..., self.rad_from], temps[..., self.rad_to]
+        rad_powers = self.rad_emissivity * self.rad_area * Network.sigma * (ta*ta*ta*ta - tb*tb*tb*tb)
+
+        if sparse:
+            if temps.ndim > 1:
+                raise ValueError("The sparse network backend does not support batches of variants")
+            con_incidence, rad_incidence = self.get_incidence()
+            node_powers = con_incidence @ con_powers + rad_incidence @ rad_powers
+            node_powers[self.cooler_nodes] -= self.get_cooler_powers(temps)
+            if len(self.enc_nodes) > 0:
+                node_powers += self._scatter(self.enc_nodes, self.get_enclosure_powers(temps))
+            return node_powers, con_powers, rad_powers
+        node_powers = self._scatter(self.con_to, con_powers)
+        node_powers -= self._scatter(self.con_from, con_powers)
+        node_powers += self._scatter(self.rad_to, rad_powers)
+        node_powers -= self._scatter(self.rad_from, rad_powers)
+        node_powers[..., self.cooler_nodes] -= self.get_cooler_powers(temps)
+        if len(self.enc_nodes) > 0:
+            node_powers += self._scatter(self.enc_nodes, self.get_enclosure_powers(temps))
+        return node_powers, con_powers, rad_powers
+
+    def get_enclosure_powers(self, temps):
+        """ Net radiative power (W) into every enclosure surface, in the order of enc_nodes. """
+        ts = temps[..., self.enc_nodes]
+        return (ts*ts*ts*ts) @ self.enc_exchange.T
+
+    def _scatter(self, nodes, values):
+        """ Sum edge values into the nodes they belong to.  A batch of shape (n_variants, n_edges) is summed in
+        one bincount by offsetting the node indices of each variant.
+        """
+        n_nodes = self.n_nodes
+        if len(nodes) == 0:
+            return np.zeros(values.shape[:-1] + (n_nodes,))
+        if values.ndim == 1:
+            return np.bincount(nodes, values, minlength=n_nodes)
+        n_variants = values.shape[0]
+        offsets = n_nodes * np.arange(0, n_variants)[:, np.newaxis]
+        sums = np.bincount((nodes + offsets).ravel(), values.ravel(), minlength=n_variants * n_nodes)
+        return sums.reshape(n_variants, n_nodes)
+
+    def get_jacobian(self, temps, sparse=False):
+        """ Jacobian dP_i/dT_j (W/K) of the net node powers returned by get_powers, as a dense array or, if
+        sparse=True, a scipy.sparse CSC matrix.
+        """
+        n_nodes = self.n_nodes
+        k_from, k_to = self.get_kint_slopes(temps)
+        ga, gb = self.con_area_length * k_from, self.con_area_length * k_to
+        ta, tb = temps[..., self.rad_from], temps[..., self.rad_to]
+        ea_sigma = self.rad_emissivity * self.rad_area * Network.sigma
+        ra, rb = 4. * ea_sigma * ta**3, 4. * ea_sigma * tb**3
+        if sparse:
+            if temps.ndim > 1:
+                raise ValueError("The sparse network backend does not support batches of variants")
+            return self._get_sparse_jacobian(temps, [(self.con_from, self.con_to, ga, gb),
+                                                     (self.rad_from, self.rad_to, ra, rb)])
+        jacobian = np.zeros(temps.shape[:-1] + (n_nodes, n_nodes))
+        Network._add_edge_terms(jacobian, self.con_from, self.con_to, ga, gb)
+        Network._add_edge_terms(jacobian, self.rad_from, self.rad_to, ra, rb)
+        nodes = self.cooler_nodes
+        jacobian[..., nodes, nodes] -= self.get_cooler_slopes(temps)
+        if len(self.enc_nodes) > 0:
+            nodes = self.enc_nodes
+            np.add.at(jacobian, (Ellipsis, nodes[:, np.newaxis], nodes), self._get_enclosure_slopes(temps))
+        return jacobian
+
+    def get_parameter_jacobian(self, temps, field):
+        """ Derivatives dP_i/dp_e (W per unit of the parameter), of shape (..., n_nodes, n_edges), of the net node
+        powers with respect to an edge parameter field, 'con_area_length', 'rad_emissivity' or 'rad_area'.  The
+        powers are linear in each of these, so the derivative is the edge power per unit parameter.
+        """
+        if field == 'con_area_length':
+            kt_from, kt_to = self.get_kints(temps)
+            rates, nodes_from, nodes_to = kt_from - kt_to, self.con_from, self.con_to
+        elif field in ['rad_emissivity', 'rad_area']:
+            ta, tb = temps[..., self.rad_from], temps[..., self.rad_to]
+            other = self.rad_area if field == 'rad_emissivity' else self.rad_emissivity
+            rates = other * Network.sigma * (ta*ta*ta*ta - tb*tb*tb*tb)
+            nodes_from, nodes_to = self.rad_from, self.rad_to
+        else:
+            raise ValueError("No parameter jacobian for network field {:s}".format(field))
+        edges = np.arange(0, len(nodes_from))
+        jacobian = np.zeros(temps.shape[:-1] + (self.n_nodes, len(edges)))
+        jacobian[..., nodes_to, edges] += rates
+        jacobian[..., nodes_from, edges] -= rates
+        return jacobian
+
+    def _get_enclosure_slopes(self, temps):
+        """ Derivatives (W/K) of the enclosure surface powers with respect to the surface temperatures. """
+        ts = temps[..., self.enc_nodes]
+        return self.enc_exchange * (4. * ts*ts*ts)[..., np.newaxis, :]
+
+    def _get_sparse_jacobian(self, temps, edge_terms):
+        if scipy_sparse is None:
+            raise ImportError("The sparse network backend needs scipy")
+        rows, cols, vals = [self.cooler_nodes], [self.cooler_nodes], [-self.get_cooler_slopes(temps)]
+        for nodes_a, nodes_b, dp_dta, dp_dtb in edge_terms:     # See _add_edge_terms
+            rows += [nodes_b, nodes_b, nodes_a, nodes_a]
+            cols += [nodes_a, nodes_b, nodes_a, nodes_b]
+            vals += [dp_dta, -dp_dtb, -dp_dta, dp_dtb]
+        n_surfaces = len(self.enc_nodes)
+        rows.append(np.repeat(self.enc_nodes, n_surfaces))
+        cols.append(np.tile(self.enc_nodes, n_surfaces))
+        vals.append(self._get_enclosure_slopes(temps).ravel())
+        rows, cols, vals = np.concatenate(rows), np.concatenate(cols), np.concatenate(vals)
+        shape = (self.n_nodes, self.n_nodes)
+        return scipy_sparse.csc_matrix((vals, (rows, cols)), shape=shape)
+
+    @staticmethod
+    def _add_edge_terms(jacobian, nodes_a, nodes_b, dp_dta, dp_dtb):
+        """ Add the derivatives of edge powers p(Ta, Tb) = f(Ta) - f(Tb), flowing from a to b, with
+        dp/dTa = dp_dta and dp/dTb = -dp_dtb.  A batched jacobian has a leading variant axis.
+        """
+        np.add.at(jacobian, (Ellipsis, nodes_b, nodes_a), dp_dta)
+        np.add.at(jacobian, (Ellipsis, nodes_b, nodes_b), -dp_dtb)
+        np.add.at(jacobian, (Ellipsis, nodes_a, nodes_a), -dp_dta)
+        np.add.at(jacobian, (Ellipsis, nodes_a, nodes_b), dp_dtb)
+        return
+
+    def find_steady_state(self, temps, fixed, **kwargs):
+        """ Find the equilibrium temperatures where the net power into every node not flagged in the boolean
+        array 'fixed' is zero.  Fixed (boundary) nodes are held at their values in temps.  Uses Newton's method
+        on the network Jacobian with pseudo-transient continuation, ie implicit steps of growing length, which
+        copes with the flat and non-monotonic parts of the cooler curves far from equilibrium.
+        """
+        tol = kwargs.get('tol', 1.0E-9)                 # Convergence on temperature change (K)
+        power_tol = kwargs.get('power_tol', 1.0E-8)     # Convergence on the largest node power imbalance (W)
+        max_iter = kwargs.get('max_iter', 200)
+        max_change = kwargs.get('max_change', 20.)      # Largest temperature change per iteration (K)
+        step = kwargs.get('pseudo_step', 10.)           # Initial pseudo time step (s)
+        free = np.logical_not(fixed)
+        temps = np.array(temps, dtype=float)
+        heat_caps = (self.masses * self.get_capacities(temps))[free]
+        node_powers = self.get_powers(temps)[0][free]
+        norm = np.linalg.norm(node_powers)
+        for i in range(0, max_iter):
+            jacobian = np.diag(heat_caps / step) - self.get_jacobian(temps)[np.ix_(free, free)]
+            delta = np.linalg.solve(jacobian, node_powers)
+            scale = min(1., max_change / max(np.max(np.abs(delta)), 1.0E-30))
+            delta *= scale
+            temps[free] = np.maximum(temps[free] + delta, 1.)
+            node_powers = self.get_powers(temps)[0][free]
+            new_norm = np.linalg.norm(node_powers)
+            if np.max(np.abs(delta)) < tol and np.max(np.abs(node_powers)) < power_tol:
+                return temps
+            growth = max(norm / max(new_norm, 1.0E-300), 0.1)
+            if scale == 1. and new_norm < norm:         # Small, successful steps, so at least double the step
+                growth = max(growth, 2.)
+            step = min(step * growth, 1.0E15)
+            norm = new_norm
+        raise RuntimeError("Steady state solution did not converge in {:d} iterations".format(max_iter))
+
+    def get_enthalpies(self, temps):
+        """ Specific enthalpy (J/kg) of every node, relative to the lowest tabulated temperature. """
+        return Capacitor.table.evaluate_integral(self.material_ids, temps)
+
+    def find_new_temperatures(self, temps, node_powers, delta_time, enthalpy=False):
+        """ Explicit (forward Euler) update of all node temperatures, equivalent to calling
+        Capacitor.find_new_temperature on every element.  With enthalpy=True the heat is added to the node
+        enthalpy and the temperature found from the inverse enthalpy curve, which is exact for the given heat
+        however much the heat capacity changes over the step.
+        """
+        heats = node_powers * delta_time
+        if enthalpy:
+            enthalpies = self.get_enthalpies(temps) + heats / self.masses
+            return Capacitor.table.invert_integral(self.material_ids, enthalpies)
+        new_temps = temps + heats / (self.masses * self.get_capacities(temps))
+        return new_temps
+
+    def apply(self, temps, capacitors):
+        """ Copy node temperatures back onto the capacitor objects the network was compiled from. """
+        for capacitor, temp in zip(capacitors, temps):
+            capacitor.temperature = float(temp)
+        return
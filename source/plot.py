@@ -3,7 +3,6 @@
 
 @author: achg
 """
-import matplotlib.pyplot as plt
 import numpy as np
 
 
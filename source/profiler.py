@@ -0,0 +1,66 @@
+#!/usr/bin/python
+import time
+
+
+class Profiler:
+    """ Low overhead instrumentation of the simulation loop.  The loops call lap(phase) at the end of each
+    phase, which adds the time since the previous lap to that phase, and end_tick() once per tick.  Code that
+    is passed profiler=None skips the calls altogether, so an absent profiler costs one 'is None' test per phase.
+
+    An optional callback(profiler, time) is called every 'every' ticks, eg to log progress from a long run.
+    """
+
+    def __init__(self, **kwargs):
+        self.callback = kwargs.get('callback', None)
+        self.every = kwargs.get('every', 1000)
+        self.times, self.laps = {}, {}
+        self.n_ticks, self.n_interps = 0, 0
+        self.last = time.perf_counter()
+        return
+
+    def start(self):
+        """ Restart the lap clock, eg at the start of a loop. """
+        self.last = time.perf_counter()
+        return
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.times[phase] = self.times.get(phase, 0.) + now - self.last
+        self.laps[phase] = self.laps.get(phase, 0) + 1
+        self.last = now
+        return
+
+    def end_tick(self, sim_time, n_interps):
+        """ Count a completed tick and the number of material table interpolations it made. """
+        self.n_ticks += 1
+        self.n_interps += n_interps
+        if self.callback is not None and self.n_ticks % self.every == 0:
+            self.callback(self, sim_time)
+        return
+
+    def timed(self, phase, function, *args, **kwargs):
+        """ Call function(*args, **kwargs), adding its run time to phase. """
+        self.start()
+        result = function(*args, **kwargs)
+        self.lap(phase)
+        return result
+
+    def get_report(self):
+        """ Return a dictionary of the time spent in, and number of calls to, each phase. """
+        total = sum(self.times.values())
+        phases = {}
+        for phase, seconds in self.times.items():
+            phases[phase] = {'time': seconds, 'calls': self.laps[phase],
+                             'fraction': seconds / total if total > 0. else 0.}
+        return {'phases': phases, 'total_time': total, 'n_ticks': self.n_ticks,
+                'n_interps': self.n_interps}
+
+    def __str__(self):
+        report = self.get_report()
+        text = "Profile - {:d} ticks, {:d} interpolations, {:.3f} s\n".format(report['n_ticks'],
+                                                                           report['n_interps'],
+                                                                           report['total_time'])
+        for phase, stats in sorted(report['phases'].items(), key=lambda item: -item[1]['time']):
+            text += " {:<16s} {:9.4f} s {:6.1%} {:9d} calls\n".format(phase, stats['time'], stats['fraction'],
+                                                                      stats['calls'])
+        return text
@@ -15,7 +15,6 @@ class Radiator:
         self.area = float(parea)
         self.from_to_name = caps[0].name + '->' + caps[1].name
         self.capacitors = caps                    # Massive heat capacitors connected by this conductor
-        self.power_v_time = []
         self.index = Radiator.index
         Radiator.index += 1
         return
@@ -62,7 +61,6 @@ class Radiator:
         power = self.emissivity * self.area * sigma * (ta*ta*ta*ta - tb*tb*tb*tb)   # Ta > Tb, heat flows out of a.
         cap_a.rad_power -= power                            # Ta > Tb, cap_b gets hotter, cap_a gets cooler
         cap_b.rad_power += power
-        self.power_v_time.append([time, power])
         return power, cap_a, cap_b
 
     @staticmethod
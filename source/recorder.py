@@ -0,0 +1,131 @@
+#!/usr/bin/python
+import numpy as np
+
+
+class Recorder:
+    """ History of node temperatures and conductor / radiator heat flows, held in preallocated arrays of shape
+    (n_samples, n_nodes) and (n_samples, n_edges).  Samples can be thinned by a minimum record interval and/or
+    a temperature change tolerance.  Memory is bounded by max_samples; when it is reached every other sample
+    is dropped and the record interval doubled.  If a sink (see sink.py) is given, the arrays are instead used
+    as a fixed size buffer which is streamed to disk each time it fills, so that memory use is constant.
+
+    For a batch of model variants (n_variants set, see sweep.py) each sample holds the (n_variants, n_nodes)
+    temperatures of the whole batch, and every history in get_series has shape (n_samples, n_variants).
+    """
+
+    def __init__(self, names, con_names, rad_names, **kwargs):
+        self.names, self.con_names, self.rad_names = names, con_names, rad_names
+        self.interval = kwargs.get('interval', 0.)          # Minimum time between samples (s), 0. = every tick
+        self.tolerance = kwargs.get('tolerance', None)      # Only record when a node has changed by this (K)
+        self.max_samples = kwargs.get('max_samples', 1000000)
+        self.sink = kwargs.get('sink', None)
+        n_variants = kwargs.get('n_variants', None)         # Number of variants in a batched run
+        if n_variants is not None and self.sink is not None:
+            raise ValueError("Recorder can't stream a batch of variants to a sink")
+        batch = () if n_variants is None else (n_variants,)
+        n_samples = min(kwargs.get('n_samples', 1024), self.max_samples)
+        self.n_flushed = kwargs.get('start', 0)     # Samples already in the sink, when resuming a run
+        if self.sink is not None:
+            n_samples = self.sink.chunk
+            self.sink.open(names, con_names, rad_names, start=self.n_flushed)
+        self.times = np.zeros(n_samples)
+        self.temps = np.zeros((n_samples,) + batch + (len(names),))
+        self.con_powers = np.zeros((n_samples,) + batch + (len(con_names),))
+        self.rad_powers = np.zeros((n_samples,) + batch + (len(rad_names),))
+        self.n_samples = 0
+        self.last_time, self.last_temps = None, None
+        return
+
+    def record(self, time, temps, con_powers, rad_powers):
+        """ Store a sample if it is due, returning True if it was recorded. """
+        if self.last_time is not None:
+            if time - self.last_time < self.interval:
+                return False
+            if self.tolerance is not None and np.max(np.abs(temps - self.last_temps)) < self.tolerance:
+                return False
+        if self.n_samples == len(self.times):
+            if self.sink is not None:
+                self.flush()
+            elif len(self.times) < self.max_samples:
+                self._resize(min(2 * len(self.times), self.max_samples))
+            else:
+                self._decimate()
+        i = self.n_samples
+        self.times[i] = time
+        self.temps[i] = temps
+        self.con_powers[i] = con_powers
+        self.rad_powers[i] = rad_powers
+        self.n_samples += 1
+        self.last_time, self.last_temps = time, self.temps[i]
+        return True
+
+    def flush(self):
+        """ Write the buffered samples to the sink and empty the buffer. """
+        n = self.n_samples
+        self.sink.append(self.times[0:n], self.temps[0:n], self.con_powers[0:n], self.rad_powers[0:n])
+        self.n_flushed += n
+        if n > 0:
+            self.last_temps = self.last_temps.copy()
+        self.n_samples = 0
+        return
+
+    def get_position(self):
+        """ Number of samples recorded, including those already written to the sink. """
+        return self.n_flushed + self.n_samples
+
+    def close(self):
+        """ Flush any remaining samples to the sink and close it. """
+        if self.sink is not None and self.sink.is_open():
+            self.flush()
+            self.sink.close()
+        return
+
+    def _resize(self, n_samples):
+        n = self.n_samples
+        for attr in ['times', 'temps', 'con_powers', 'rad_powers']:
+            old = getattr(self, attr)
+            new = np.zeros((n_samples,) + old.shape[1:])
+            new[0:n] = old[0:n]
+            setattr(self, attr, new)
+        self.last_temps = self.temps[n-1] if n > 0 else None
+        return
+
+    def _decimate(self):
+        """ Keep every other sample, halving the time resolution of the stored history. """
+        keep = np.arange(0, self.n_samples, 2)
+        n = len(keep)
+        for attr in ['times', 'temps', 'con_powers', 'rad_powers']:
+            array = getattr(self, attr)
+            array[0:n] = array[keep]
+        self.n_samples = n
+        self.interval = max(2. * self.interval, self.times[1] - self.times[0] if n > 1 else 0.)
+        self.last_time, self.last_temps = self.times[n-1], self.temps[n-1]
+        return
+
+    def get_arrays(self):
+        """ The recorded samples as a dictionary of arrays, eg for a ResultCache. """
+        n = self.n_samples
+        return {'times': self.times[0:n], 'temps': self.temps[0:n], 'con_powers': self.con_powers[0:n],
+                'rad_powers': self.rad_powers[0:n]}
+
+    def set_arrays(self, arrays):
+        """ Replace the recorded samples with those returned by get_arrays. """
+        for attr in ['times', 'temps', 'con_powers', 'rad_powers']:
+            setattr(self, attr, np.array(arrays[attr]))
+        self.n_samples = len(self.times)
+        n = self.n_samples
+        self.last_time, self.last_temps = (self.times[n-1], self.temps[n-1]) if n > 0 else (None, None)
+        return
+
+    def get_series(self):
+        """ Return the recorded times and dictionaries of temperature and power histories keyed by element
+        name.  The histories are views onto the recorder arrays, or onto the sink's storage.
+        """
+        if self.sink is not None:
+            self.close()
+            return self.sink.get_series()
+        n = self.n_samples
+        temp_series = {name: self.temps[0:n, ..., j] for j, name in enumerate(self.names)}
+        con_series = {name: self.con_powers[0:n, ..., j] for j, name in enumerate(self.con_names)}
+        rad_series = {name: self.rad_powers[0:n, ..., j] for j, name in enumerate(self.rad_names)}
+        return self.times[0:n], temp_series, con_series, rad_series
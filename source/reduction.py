@@ -0,0 +1,178 @@
+#!/usr/bin/python
+import copy
+import logging
+import numpy as np
+from capacitor import Capacitor
+from conductor import Conductor
+from network import Network
+from recorder import Recorder
+
+log = logging.getLogger(__name__)
+
+
+class Reduction:
+    """ Reduced order form of a model, in which capacitors joined by conductors so stiff that they equilibrate
+    within a small fraction of the simulation tick are merged into lumped super-nodes.  A conductor between
+    nodes of heat capacity Ca and Cb with conductance G relaxes their temperature difference with time constant
+
+        tau = Ca Cb / ((Ca + Cb) G),
+
+    and the conductors are merged in order of increasing tau while it is below ratio * delta_time, using the
+    capacities of the clusters merged so far.  A short tau alone is not enough, since a stiff link may still
+    carry a large steady heat flow across a real temperature drop, which a merged node would lose.  So the
+    model's steady state is found first (boundary nodes, at least boundary_mass kg, held at their temperature)
+    and a merge is only made if the members of the merged cluster are then within max_drop kelvin of each other.
+    The error of the reduced model is of the order of the largest drop merged, plus any transient drop across
+    the merged links while heat flows through them.  max_drop does not bound the transient drop, which during
+    a cooldown can be many times the steady one, so keep max_drop small (see check.py).
+
+    Each super-node has the name, material and colour of its largest member (or of its cooler), the combined
+    heat capacity of its members at their current temperatures and their capacity weighted mean temperature.
+    Conductors and radiators inside a super-node are dropped (a meshed conductor is never merged along).
+    Capacitors named in 'keep', and coolers, are never merged into each other, so they can still be referred to
+    by name (eg in stop conditions).
+
+    The reduced element lists are capacitors, conductors, radiators and enclosures, any element not touched by
+    a merge being the original object.  apply() and expand_recorder() map the results back onto the original
+    capacitors, every member of a super-node taking its temperature.
+    """
+
+    def __init__(self, capacitors, conductors, radiators, enclosures, delta_time, **kwargs):
+        ratio = kwargs.get('ratio', 0.1)            # Merge conductors with tau below ratio * delta_time
+        keep = kwargs.get('keep', [])               # Capacitors which must keep their identity
+        max_drop = kwargs.get('max_drop', 0.1)      # Largest steady state temperature spread within a super-node (K)
+        boundary_mass = kwargs.get('boundary_mass', 1000.)     # Nodes held fixed in the steady state
+        self.original = capacitors
+        n_caps = len(capacitors)
+        index = {id(cap): i for i, cap in enumerate(capacitors)}
+        temps = np.array([cap.temperature for cap in capacitors])
+        heat_caps = np.array([cap.mass for cap in capacitors]) * Capacitor.table.evaluate(
+            np.array([cap.material_id for cap in capacitors], dtype=int), temps)
+        pinned = np.array([cap.is_cooler or cap.name in keep for cap in capacitors])
+        network = Network(capacitors, conductors, radiators, enclosures)
+        try:
+            steady = network.find_steady_state(network.temperatures, network.masses >= boundary_mass)
+        except RuntimeError:
+            log.warning('No steady state found for the model, so no nodes are merged')
+            steady = None
+
+        links = []
+        for conductor in conductors:
+            if conductor.segments > 1:
+                continue
+            a, b = index[id(conductor.capacitors[0])], index[id(conductor.capacitors[1])]
+            k_ab = Conductor.table.evaluate_slope(np.array([conductor.material_id] * 2), temps[[a, b]])
+            links.append((conductor.xsarea_length * 0.5 * float(np.sum(k_ab)), a, b))
+        parents = list(range(0, n_caps))              # Union-find forest of clusters
+        cluster_caps, cluster_pinned = heat_caps.copy(), pinned.copy()
+        if steady is not None:
+            cluster_low, cluster_high = steady.copy(), steady.copy()     # Steady temperature range of each cluster
+        limit = ratio * delta_time
+        merging = steady is not None
+        while merging:                              # Merge the stiffest link, then re-rank with the new capacities
+            merging, best = False, None
+            for conductance, a, b in links:
+                ra, rb = Reduction._find(parents, a), Reduction._find(parents, b)
+                if ra == rb or (cluster_pinned[ra] and cluster_pinned[rb]) or conductance <= 0.:
+                    continue
+                spread = max(cluster_high[ra], cluster_high[rb]) - min(cluster_low[ra], cluster_low[rb])
+                if spread > max_drop:
+                    continue
+                ca, cb = cluster_caps[ra], cluster_caps[rb]
+                tau = ca * cb / ((ca + cb) * conductance)
+                if tau < limit and (best is None or tau < best[0]):
+                    best = tau, ra, rb
+            if best is not None:
+                _, ra, rb = best
+                parents[rb] = ra
+                cluster_caps[ra] += cluster_caps[rb]
+                cluster_pinned[ra] = cluster_pinned[ra] or cluster_pinned[rb]
+                cluster_low[ra] = min(cluster_low[ra], cluster_low[rb])
+                cluster_high[ra] = max(cluster_high[ra], cluster_high[rb])
+                merging = True
+        roots = [Reduction._find(parents, i) for i in range(0, n_caps)]
+
+        self.capacitors, self.groups = [], []
+        node_map, reduced = np.zeros(n_caps, dtype=int), {}
+        for root in sorted(set(roots)):
+            members = [i for i in range(0, n_caps) if roots[i] == root]
+            reduced[root] = self._merge(capacitors, members, heat_caps, temps, pinned)
+            node_map[members] = len(self.capacitors)
+            self.capacitors.append(reduced[root])
+            self.groups.append([capacitors[i].name for i in members])
+        self.node_map = node_map                    # Reduced node of each original capacitor
+        cap_map = {id(cap): reduced[roots[i]] for i, cap in enumerate(capacitors)}
+        self.conductors = Reduction._map_edges(conductors, cap_map)
+        self.radiators = Reduction._map_edges(radiators, cap_map)
+        self.enclosures = []
+        for enclosure in enclosures:
+            caps = [cap_map[id(cap)] for cap in enclosure.capacitors]
+            if any([cap is not old for cap, old in zip(caps, enclosure.capacitors)]):
+                enclosure = copy.copy(enclosure)
+                enclosure.capacitors = caps
+            self.enclosures.append(enclosure)
+        return
+
+    @staticmethod
+    def _find(parents, i):
+        """ Root of the cluster holding node i, halving the path to it. """
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    @staticmethod
+    def _merge(capacitors, members, heat_caps, temps, pinned):
+        """ Super-node standing for the capacitors with indices members (the capacitor itself if alone). """
+        if len(members) == 1:
+            return capacitors[members[0]]
+        ranked = sorted(members, key=lambda i: (not pinned[i], -heat_caps[i]))
+        base = capacitors[ranked[0]]
+        heat_cap = float(np.sum(heat_caps[members]))
+        temperature = float(np.sum(heat_caps[members] * temps[members])) / heat_cap
+        node = copy.copy(base)
+        node.temperature, node.new_temperature = temperature, temperature
+        node.con_power, node.rad_power = 0., 0.
+        if all([capacitors[i].material_id == base.material_id for i in members]):
+            node.mass = float(np.sum([capacitors[i].mass for i in members]))
+        else:                                       # Match the combined heat capacity at the current temperature
+            node.mass = heat_cap / float(Capacitor.table.evaluate(np.array([base.material_id]),
+                                                                  np.array([temperature]))[0])
+        return node
+
+    @staticmethod
+    def _map_edges(edges, cap_map):
+        """ Copies of the conductors or radiators joining the super-nodes, dropping those inside one. """
+        mapped = []
+        for edge in edges:
+            caps = [cap_map[id(cap)] for cap in edge.capacitors]
+            if caps[0] is caps[1]:
+                continue
+            if caps[0] is not edge.capacitors[0] or caps[1] is not edge.capacitors[1]:
+                edge = copy.copy(edge)
+                edge.capacitors = caps
+                edge.from_to_name = caps[0].name + '->' + caps[1].name
+            mapped.append(edge)
+        return mapped
+
+    def get_model(self):
+        return self.capacitors, self.conductors, self.radiators, self.enclosures
+
+    def expand(self, temps):
+        """ Temperatures (..., n_original) of the original capacitors from those of the reduced model. """
+        return temps[..., self.node_map]
+
+    def apply(self):
+        """ Set the temperature of every original capacitor to that of its super-node. """
+        for capacitor, i in zip(self.original, self.node_map):
+            capacitor.temperature = self.capacitors[i].temperature
+        return
+
+    def expand_recorder(self, recorder):
+        """ Copy of a Recorder of the reduced model with the temperature histories of the original capacitors. """
+        arrays = recorder.get_arrays()
+        arrays['temps'] = self.expand(arrays['temps'])
+        expanded = Recorder([cap.name for cap in self.original], recorder.con_names, recorder.rad_names,
+                            interval=recorder.interval, n_samples=1)
+        expanded.set_arrays(arrays)
+        return expanded
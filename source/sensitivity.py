@@ -0,0 +1,116 @@
+#!/usr/bin/python
+import numpy as np
+from capacitor import Capacitor
+from sweep import Sweep
+
+
+class Sensitivity:
+    """ Forward sensitivity analysis of a compiled Network.  Alongside the temperatures T the run integrates
+    their derivatives S = dT/dp with respect to every selected parameter p,
+
+        dT/dt = f(T, p) = P(T, p) / (m c(T)),      dS/dt = df/dT S + df/dp,
+
+    where df/dT is formed from the analytic network Jacobian (kint slopes, 4 e sigma A T^3 and cooler slopes,
+    see Network.get_jacobian) and the heat capacity slope, and df/dp from Network.get_parameter_jacobian.  Both
+    are integrated by explicit Euler, so S is the exact derivative of the Euler solution and one run gives every
+    sensitivity, rather than one run per finite difference.  The parameters are keyed '<parameter>:<element>',
+
+        'area_length'           - cross-section area / length (m) of the named conductor
+        'emissivity', 'area'    - emissivity and area (m2) of the named radiator
+        'mass', 'temperature'   - mass (kg) and initial temperature (K) of the named capacitor
+
+    eg ['area_length:det_link', 'emissivity:window', 'mass:block'].  The sensitivity of a cooldown time
+    follows from the temperature sensitivity at the crossing, see get_crossing_sensitivities.
+    """
+
+    parameters = {'area_length': ('con_area_length', 'con_element_names'),
+                  'emissivity': ('rad_emissivity', 'rad_element_names'),
+                  'area': ('rad_area', 'rad_element_names'),
+                  'mass': ('masses', 'names'),
+                  'temperature': ('temperatures', 'names')}
+
+    def __init__(self, network, keys):
+        if np.any(network.con_segments > 1):
+            raise ValueError("Sensitivity analysis does not support meshed conductors")
+        self.network = network
+        self.keys = keys
+        self.columns = []                   # (network field, index) of each parameter
+        for key in keys:
+            tokens = key.split(':')
+            if len(tokens) != 2 or tokens[0] not in Sensitivity.parameters:
+                raise ValueError("Sensitivity key {:s} is not '<parameter>:<element>' with parameter one of "
+                                 "{:s}".format(key, str(list(Sensitivity.parameters.keys()))))
+            field, name_field = Sensitivity.parameters[tokens[0]]
+            self.columns.append((field, Sweep._find_element(network, tokens[0], tokens[1], name_field)))
+        self.values = np.array([getattr(network, field)[index] for field, index in self.columns])
+        self.times, self.temps, self.sensitivities = None, None, None
+        return
+
+    def get_rates(self, temps):
+        """ Rates of change of the node temperatures and of their sensitivities, as functions of S. """
+        network = self.network
+        node_powers = network.get_powers(temps)[0]
+        capacities = network.get_capacities(temps)
+        heat_caps = network.masses * capacities
+        rates = node_powers / heat_caps
+        slopes = Capacitor.table.evaluate_slope(network.material_ids, temps)
+        rate_jacobian = network.get_jacobian(temps) / heat_caps[:, np.newaxis]
+        rate_jacobian[np.diag_indices(network.n_nodes)] -= rates * slopes / capacities
+        forcing = np.zeros((network.n_nodes, len(self.keys)))
+        parameter_jacobians = {}
+        for j, (field, index) in enumerate(self.columns):
+            if field == 'masses':
+                forcing[index, j] = -rates[index] / network.masses[index]
+            elif field != 'temperatures':
+                if field not in parameter_jacobians:
+                    parameter_jacobians[field] = network.get_parameter_jacobian(temps, field)
+                forcing[:, j] = parameter_jacobians[field][:, index] / heat_caps
+        return rates, rate_jacobian, forcing
+
+    def run(self, run_time, delta_time, **kwargs):
+        """ Integrate the temperatures and sensitivities from the network temperatures for run_time seconds,
+        keeping samples at least record_interval apart in self.times, self.temps (n_samples, n_nodes) and
+        self.sensitivities (n_samples, n_nodes, n_parameters).  Returns the final sensitivities.
+        """
+        record_interval = kwargs.get('record_interval', 0.)    # Minimum time between samples (s)
+        network = self.network
+        temps = np.array(network.temperatures, dtype=float)
+        sensitivities = np.zeros((network.n_nodes, len(self.keys)))
+        for j, (field, index) in enumerate(self.columns):
+            if field == 'temperatures':
+                sensitivities[index, j] = 1.
+        times, temp_samples, samples = [0.], [temps], [sensitivities]
+        time, last_time = 0., 0.
+        while time < run_time - 0.5 * delta_time:
+            rates, rate_jacobian, forcing = self.get_rates(temps)
+            sensitivities = sensitivities + delta_time * (rate_jacobian @ sensitivities + forcing)
+            temps = temps + delta_time * rates
+            time += delta_time
+            if time - last_time >= record_interval:
+                times.append(time)
+                temp_samples.append(temps)
+                samples.append(sensitivities)
+                last_time = time
+        self.times, self.temps, self.sensitivities = np.array(times), np.array(temp_samples), np.array(samples)
+        return sensitivities
+
+    def get_crossing_sensitivities(self, name, temperature, relative=False):
+        """ Derivatives of the time at which capacitor 'name' first cools to temperature with respect to every
+        parameter, dt/dp = -dT/dp / (dT/dt) at the crossing, as a dictionary keyed like the parameters.  With
+        relative=True they are scaled to p dt/dp, ie the seconds gained per fractional change of the parameter,
+        which ranks the parameters by their effect.  Returns None if the run did not reach the temperature.
+        """
+        node = self.network.names.index(name)
+        series = self.temps[:, node]
+        below = np.flatnonzero(series <= temperature)
+        if len(below) == 0 or below[0] == 0:
+            return None
+        k = below[0]
+        frac = (series[k-1] - temperature) / (series[k-1] - series[k])
+        rate = (series[k] - series[k-1]) / (self.times[k] - self.times[k-1])
+        sensitivity = self.sensitivities[k-1, node] + frac * (self.sensitivities[k, node] -
+                                                               self.sensitivities[k-1, node])
+        derivatives = -sensitivity / rate
+        if relative:
+            derivatives = derivatives * self.values
+        return dict(zip(self.keys, derivatives))
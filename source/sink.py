@@ -0,0 +1,177 @@
+#!/usr/bin/python
+import os
+import json
+import numpy as np
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+class MemmapSink:
+    """ Append-only on-disk store for Recorder samples.  Each quantity is streamed to a raw float64 file in the
+    directory 'path' (times.f8, temps.f8, con_powers.f8, rad_powers.f8) with the element names and sample count
+    in meta.json.  The results are read back as read-only memory maps, so nothing is copied into RAM until it
+    is used.
+    """
+
+    quantities = ['times', 'temps', 'con_powers', 'rad_powers']
+
+    def __init__(self, path, **kwargs):
+        self.path = path
+        self.chunk = kwargs.get('chunk', 4096)      # Samples buffered in memory between writes
+        self.meta, self.files = None, {}
+        return
+
+    def open(self, names, con_names, rad_names, start=0):
+        """ Start a new store, or when resuming a run keep the first 'start' samples already in it. """
+        os.makedirs(self.path, exist_ok=True)
+        self.meta = {'names': names, 'con_names': con_names, 'rad_names': rad_names, 'n_samples': start}
+        widths = {'times': 1, 'temps': len(names), 'con_powers': len(con_names), 'rad_powers': len(rad_names)}
+        for quantity in MemmapSink.quantities:
+            file_path = os.path.join(self.path, quantity + '.f8')
+            if start > 0:
+                if os.path.getsize(file_path) < 8 * widths[quantity] * start:
+                    raise ValueError("{:s} holds fewer than {:d} samples".format(file_path, start))
+                os.truncate(file_path, 8 * widths[quantity] * start)
+                self.files[quantity] = open(file_path, 'ab')
+            else:
+                self.files[quantity] = open(file_path, 'wb')
+        self._write_meta()
+        return
+
+    def append(self, times, temps, con_powers, rad_powers):
+        """ Write a chunk of samples, each array having the sample number as its first axis. """
+        for quantity, block in zip(MemmapSink.quantities, [times, temps, con_powers, rad_powers]):
+            self.files[quantity].write(np.ascontiguousarray(block, dtype='<f8').tobytes())
+            self.files[quantity].flush()
+        self.meta['n_samples'] += len(times)
+        self._write_meta()
+        return
+
+    def is_open(self):
+        return len(self.files) > 0
+
+    def close(self):
+        for text_file in self.files.values():
+            text_file.close()
+        self.files = {}
+        return
+
+    def _write_meta(self):
+        with open(os.path.join(self.path, 'meta.json'), 'w') as text_file:
+            json.dump(self.meta, text_file)
+        return
+
+    def get_series(self):
+        return MemmapSink.read(self.path)
+
+    @staticmethod
+    def read(path):
+        """ Return the times and dictionaries of temperature and power histories keyed by element name, as
+        zero-copy views onto memory maps of the files in path.
+        """
+        with open(os.path.join(path, 'meta.json'), 'r') as text_file:
+            meta = json.load(text_file)
+        n = meta['n_samples']
+        columns = {'times': None, 'temps': len(meta['names']),
+                   'con_powers': len(meta['con_names']), 'rad_powers': len(meta['rad_names'])}
+        arrays = {}
+        for quantity, n_cols in columns.items():
+            file_path = os.path.join(path, quantity + '.f8')
+            shape = (n,) if n_cols is None else (n, n_cols)
+            if n == 0 or n_cols == 0:
+                arrays[quantity] = np.zeros(shape)
+            else:
+                arrays[quantity] = np.memmap(file_path, dtype='<f8', mode='r', shape=shape)
+        temp_series = {name: arrays['temps'][:, j] for j, name in enumerate(meta['names'])}
+        con_series = {name: arrays['con_powers'][:, j] for j, name in enumerate(meta['con_names'])}
+        rad_series = {name: arrays['rad_powers'][:, j] for j, name in enumerate(meta['rad_names'])}
+        return arrays['times'], temp_series, con_series, rad_series
+
+
+class Hdf5Sink:
+    """ Chunked, resizable HDF5 store for Recorder samples (requires h5py).  Reading back loads the sample
+    times, while every history is an Hdf5Column which only reads its column from the file when it is used.
+    """
+
+    def __init__(self, path, **kwargs):
+        if h5py is None:
+            raise ImportError("Hdf5Sink needs the h5py package, use MemmapSink instead")
+        self.path = path
+        self.chunk = kwargs.get('chunk', 4096)
+        self.h5 = None
+        return
+
+    def open(self, names, con_names, rad_names, start=0):
+        """ Start a new file, or when resuming a run keep the first 'start' samples already in it. """
+        if start > 0:
+            self.h5 = h5py.File(self.path, 'a')
+            for quantity in MemmapSink.quantities:
+                if len(self.h5[quantity]) < start:
+                    raise ValueError("{:s} holds fewer than {:d} samples".format(self.path, start))
+                self.h5[quantity].resize(start, axis=0)
+            return
+        self.h5 = h5py.File(self.path, 'w')
+        for quantity, labels in [('temps', names), ('con_powers', con_names), ('rad_powers', rad_names)]:
+            self.h5.create_dataset(quantity, shape=(0, len(labels)), maxshape=(None, len(labels)),
+                                   chunks=(self.chunk, max(len(labels), 1)), dtype='f8')
+            self.h5[quantity].attrs['names'] = json.dumps(labels)
+        self.h5.create_dataset('times', shape=(0,), maxshape=(None,), chunks=(self.chunk,), dtype='f8')
+        return
+
+    def append(self, times, temps, con_powers, rad_powers):
+        n_old, n_new = len(self.h5['times']), len(times)
+        for quantity, block in zip(MemmapSink.quantities, [times, temps, con_powers, rad_powers]):
+            dataset = self.h5[quantity]
+            dataset.resize(n_old + n_new, axis=0)
+            dataset[n_old:n_old + n_new] = block
+        self.h5.flush()
+        return
+
+    def is_open(self):
+        return self.h5 is not None
+
+    def close(self):
+        self.h5.close()
+        self.h5 = None
+        return
+
+    def get_series(self):
+        return Hdf5Sink.read(self.path)
+
+    @staticmethod
+    def read(path):
+        """ Return the times and dictionaries of lazy temperature and power histories keyed by element name.
+        The file is left open for reading until the last of the histories is released.
+        """
+        series = []
+        h5 = h5py.File(path, 'r')
+        times = h5['times'][()]
+        for quantity in MemmapSink.quantities[1:]:
+            dataset = h5[quantity]
+            names = json.loads(dataset.attrs['names'])
+            series.append({name: Hdf5Column(h5, dataset, j) for j, name in enumerate(names)})
+        return times, series[0], series[1], series[2]
+
+
+class Hdf5Column:
+    """ History of one element, column j of an HDF5 dataset, read from the file only when it is indexed (eg
+    column[-1] or column[1000:2000]) or converted to an array (eg np.asarray(column), or by matplotlib).
+    """
+
+    def __init__(self, h5, dataset, j):
+        self.h5 = h5                    # Keeps the file open
+        self.dataset, self.j = dataset, j
+        self.shape, self.dtype = (dataset.shape[0],), dataset.dtype
+        return
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        return self.dataset[key, self.j]
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.dataset[:, self.j]
+        return values if dtype is None else values.astype(dtype)
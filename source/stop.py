@@ -0,0 +1,112 @@
+#!/usr/bin/python
+import numpy as np
+
+
+class StopCondition:
+    """ Condition which ends a run early.  The simulation loops call bind() once with the node names and then
+    check() after every step, which returns the time at which the condition was met, or None.  For a batch of
+    variants (see sweep.py) a condition is met when it is met by every variant.
+    """
+
+    def __init__(self):
+        return
+
+    def bind(self, names):
+        return
+
+    def check(self, time, step, temps, new_temps, node_powers):
+        """ Test the step from time to time + step, which took the node temperatures from temps to new_temps
+        with net node powers node_powers (W) at the start of the step.
+        """
+        return None
+
+    @staticmethod
+    def _find_nodes(names, selected):
+        """ Indices of the named nodes, raising ValueError for names not in the model. """
+        for name in selected:
+            if name not in names:
+                raise ValueError("Stop condition refers to unknown capacitor {:s}".format(name))
+        return np.array([names.index(name) for name in selected], dtype=int)
+
+
+class Threshold(StopCondition):
+    """ Stop when capacitor 'name' cools to (or with falling=False, warms to) temperature, eg Threshold('block',
+    40.).  The trigger time is interpolated within the step.
+    """
+
+    def __init__(self, name, temperature, **kwargs):
+        StopCondition.__init__(self)
+        self.name, self.temperature = name, temperature
+        self.falling = kwargs.get('falling', True)
+        self.node = None
+        return
+
+    def bind(self, names):
+        self.node = StopCondition._find_nodes(names, [self.name])[0]
+        return
+
+    def check(self, time, step, temps, new_temps, node_powers):
+        old, new = temps[..., self.node], new_temps[..., self.node]
+        reached = new <= self.temperature if self.falling else new >= self.temperature
+        if not np.all(reached):
+            return None
+        change = np.where(old != new, old - new, 1.)
+        frac = np.clip((old - self.temperature) / change, 0., 1.)
+        return time + step * float(np.max(frac))
+
+    def __str__(self):
+        direction = 'below' if self.falling else 'above'
+        return "{:s} {:s} {:.2f} K".format(self.name, direction, self.temperature)
+
+
+class SteadyState(StopCondition):
+    """ Stop when no capacitor is changing temperature faster than rate_tol (K/s).  Heavy boundary nodes
+    which are still drifting slowly can be left out by naming them in 'ignore'.
+    """
+
+    def __init__(self, rate_tol=1.0E-5, **kwargs):
+        StopCondition.__init__(self)
+        self.rate_tol = rate_tol
+        self.ignore = kwargs.get('ignore', [])
+        self.nodes = None
+        return
+
+    def bind(self, names):
+        ignored = StopCondition._find_nodes(names, self.ignore)
+        self.nodes = np.setdiff1d(np.arange(0, len(names)), ignored)
+        return
+
+    def check(self, time, step, temps, new_temps, node_powers):
+        rates = np.abs(new_temps[..., self.nodes] - temps[..., self.nodes]) / step
+        if np.max(rates, initial=0.) < self.rate_tol:
+            return time + step
+        return None
+
+    def __str__(self):
+        return "steady state, |dT/dt| < {:.1e} K/s".format(self.rate_tol)
+
+
+class PowerBalance(StopCondition):
+    """ Stop when the net power into every capacitor, except those named in 'ignore', is below power_tol (W),
+    ie the cooler load balances the heat leaks.
+    """
+
+    def __init__(self, power_tol=1.0E-3, **kwargs):
+        StopCondition.__init__(self)
+        self.power_tol = power_tol
+        self.ignore = kwargs.get('ignore', [])
+        self.nodes = None
+        return
+
+    def bind(self, names):
+        ignored = StopCondition._find_nodes(names, self.ignore)
+        self.nodes = np.setdiff1d(np.arange(0, len(names)), ignored)
+        return
+
+    def check(self, time, step, temps, new_temps, node_powers):
+        if np.max(np.abs(node_powers[..., self.nodes]), initial=0.) < self.power_tol:
+            return time + step
+        return None
+
+    def __str__(self):
+        return "power balance, |P| < {:.1e} W".format(self.power_tol)
@@ -0,0 +1,169 @@
+#!/usr/bin/python
+import numpy as np
+from capacitor import Capacitor
+from conductor import Conductor
+try:
+    import scipy.sparse as scipy_sparse
+except ImportError:
+    scipy_sparse = None
+
+
+class Straps:
+    """ Meshed conductors of a Network (those with con_segments > 1).  Each strap is divided into K equal
+    segments, each carrying 1/K of the strap mass at its centre, joined to each other by links of conductance
+    K * A/L and to the end capacitors by half segments of conductance 2K * A/L.  The segment temperatures are
+    held as an (..., n_straps, K_max) array, padded beyond each strap's K.
+
+    linearise() makes a backward Euler step of every strap, solving the tridiagonal system of each chain by the
+    Thomas algorithm in O(K) vectorised operations over all the straps (and variants).  The step is solved with
+    the end capacitors held and for a unit change at either end, so the segment temperatures and end heat flows
+    are linear in the end changes over the step.  An implicit network solver includes the strap flows through
+    get_jacobian, which is the Schur complement of the chain onto its end nodes, so that a strap is stable at
+    any step.  The end heat flows are those used in the chain update, so heat is conserved between the straps
+    and the network.
+    """
+
+    def __init__(self, network):
+        self.network = network
+        self.cons = np.flatnonzero(network.con_segments > 1)
+        self.n_straps = len(self.cons)
+        segments = network.con_segments[self.cons]
+        self.segments = segments
+        self.k_max = int(np.max(segments)) if self.n_straps > 0 else 0
+        cells = np.arange(0, self.k_max)
+        self.mask = cells < segments[:, np.newaxis]                 # Real (not padding) segments
+        self.last = segments - 1                                    # Index of the segment next to the 'to' end
+        area_length = network.con_area_length[..., self.cons]
+        # Conductance factor of link i, which joins segment i-1 (or the 'from' end) to segment i (or the 'to' end)
+        links = np.arange(0, self.k_max + 1)
+        factor = np.where(links <= segments[:, np.newaxis], segments[:, np.newaxis], 0.)
+        factor = np.where((links == 0) | (links == segments[:, np.newaxis]), 2. * factor, factor)
+        self.conductance = area_length[..., np.newaxis] * factor     # (..., n_straps, k_max + 1)
+        self.g_left = np.where(self.mask, self.conductance[..., :-1], 0.)     # Conductance either side of a segment
+        self.g_right = np.where(self.mask, self.conductance[..., 1:], 0.)
+        self.is_last = cells == self.last[:, np.newaxis]
+        end = np.broadcast_to(segments[:, np.newaxis], self.conductance.shape[:-1] + (1,))
+        self.g_end = np.take_along_axis(self.conductance, end, axis=-1)[..., 0]
+        masses = network.con_masses[..., self.cons] / segments
+        self.cell_masses = np.where(self.mask, masses[..., np.newaxis], 1.)
+        self.kint_ids = network.con_material_ids[self.cons][:, np.newaxis]
+        self.capacity_ids = network.con_capacity_ids[self.cons][:, np.newaxis]
+        return
+
+    def get_initial_temperatures(self, temps):
+        """ Segment temperatures varying linearly between the temperatures of the end capacitors. """
+        network = self.network
+        ta = temps[..., network.con_from[self.cons]][..., np.newaxis]
+        tb = temps[..., network.con_to[self.cons]][..., np.newaxis]
+        frac = (np.arange(0, self.k_max) + 0.5) / self.segments[:, np.newaxis]
+        return np.where(self.mask, ta + np.minimum(frac, 1.) * (tb - ta), ta)
+
+    @staticmethod
+    def solve_tridiagonal(lower, diag, upper, rhs):
+        """ Thomas algorithm for the systems lower[i] x[i-1] + diag[i] x[i] + upper[i] x[i+1] = rhs[i], with the
+        chain along the last axis, vectorised over all the leading axes.
+        """
+        n = diag.shape[-1]
+        c, d = np.zeros(diag.shape), np.zeros(diag.shape)
+        c[..., 0] = upper[..., 0] / diag[..., 0]
+        d[..., 0] = rhs[..., 0] / diag[..., 0]
+        for i in range(1, n):
+            denominator = diag[..., i] - lower[..., i] * c[..., i-1]
+            c[..., i] = upper[..., i] / denominator
+            d[..., i] = (rhs[..., i] - lower[..., i] * d[..., i-1]) / denominator
+        x = np.zeros(diag.shape)
+        x[..., n-1] = d[..., n-1]
+        for i in range(n-2, -1, -1):
+            x[..., i] = d[..., i] - c[..., i] * x[..., i+1]
+        return x
+
+    def linearise(self, temps, strap_temps, delta_time):
+        """ Backward Euler step of the segments over delta_time, linearised in the changes of the end capacitor
+        temperatures over the step, so that the network solver can include the straps implicitly.  Keeps the
+        segment changes and end heat flows with the ends held, and their slopes with respect to the end changes,
+        for get_new_temperatures, get_powers and get_jacobian.
+        """
+        network = self.network
+        table = Conductor.table
+        material_ids = network.con_material_ids[self.cons]
+        ta, tb = temps[..., network.con_from[self.cons]], temps[..., network.con_to[self.cons]]
+        kints = table.evaluate(self.kint_ids, strap_temps)
+        slopes = table.evaluate_slope(self.kint_ids, strap_temps)
+        kint_a, kint_b = table.evaluate(material_ids, ta), table.evaluate(material_ids, tb)
+        slope_a, slope_b = table.evaluate_slope(material_ids, ta), table.evaluate_slope(material_ids, tb)
+        heat_caps = self.cell_masses * Capacitor.table.evaluate(self.capacity_ids, strap_temps)
+        # Integrated conductivity to the left and right of each segment
+        left = np.concatenate((kint_a[..., np.newaxis], kints[..., :-1]), axis=-1)
+        right = np.concatenate((kints[..., 1:], np.zeros(kints.shape[:-1] + (1,))), axis=-1)
+        right = np.where(self.is_last, kint_b[..., np.newaxis], right)
+        g_left, g_right = self.g_left, self.g_right
+        flux = g_left * (left - kints) - g_right * (kints - right)
+        # Linearised implicit update, kint(T + dT) = kint(T) + k(T) dT, with the ends fixed and then with a unit
+        # change at either end, which enters the flux of the first or last segment
+        slopes_left = np.concatenate((np.zeros(slopes.shape[:-1] + (1,)), slopes[..., :-1]), axis=-1)
+        slopes_right = np.concatenate((slopes[..., 1:], np.zeros(slopes.shape[:-1] + (1,))), axis=-1)
+        diag = heat_caps / delta_time + (g_left + g_right) * slopes
+        lower = -g_left * slopes_left
+        upper = np.where(self.is_last, 0., -g_right * slopes_right)
+        first = np.arange(0, self.k_max) == 0
+        rhs = np.stack((flux, np.where(first, g_left * slope_a[..., np.newaxis], 0.),
+                        np.where(self.is_last, g_right * slope_b[..., np.newaxis], 0.)))
+        lower, diag, upper = [np.broadcast_to(a, rhs.shape) for a in [lower, diag, upper]]
+        deltas = np.where(self.mask, Straps.solve_tridiagonal(lower, diag, upper, rhs), 0.)
+        self.deltas = deltas                                # Held, per unit 'from' change, per unit 'to' change
+        # End heat flows from the linearised kint at the end of the step, kints + slopes * deltas
+        last = np.broadcast_to(self.last[:, np.newaxis], kints.shape[:-1] + (1,))
+        s_first, s_last = slopes[..., 0], np.take_along_axis(slopes, last, axis=-1)[..., 0]
+        last_deltas = np.broadcast_to(self.last[:, np.newaxis], deltas.shape[:-1] + (1,))
+        d_first, d_last = deltas[..., 0], np.take_along_axis(deltas, last_deltas, axis=-1)[..., 0]
+        g_first = self.conductance[..., 0]
+        k_last = np.take_along_axis(kints, last, axis=-1)[..., 0]
+        self.power_from = np.stack((g_first * (kint_a - kints[..., 0] - s_first * d_first[0]),
+                                    g_first * (slope_a - s_first * d_first[1]), -g_first * s_first * d_first[2]))
+        self.power_to = np.stack((self.g_end * (k_last + s_last * d_last[0] - kint_b),
+                                  self.g_end * s_last * d_last[1], self.g_end * (s_last * d_last[2] - slope_b)))
+        return
+
+    def get_end_changes(self, changes):
+        """ Temperature changes of the 'from' and 'to' ends of each strap, from the node changes. """
+        network = self.network
+        return changes[..., network.con_from[self.cons]], changes[..., network.con_to[self.cons]]
+
+    def get_new_temperatures(self, strap_temps, changes):
+        """ Segment temperatures at the end of the linearised step, given the node temperature changes. """
+        change_a, change_b = self.get_end_changes(changes)
+        return (strap_temps + self.deltas[0] + self.deltas[1] * change_a[..., np.newaxis] +
+                self.deltas[2] * change_b[..., np.newaxis])
+
+    def get_powers(self, changes):
+        """ Heat flows (W) into each strap at its 'from' end and out of it at its 'to' end over the linearised
+        step, given the node temperature changes.
+        """
+        change_a, change_b = self.get_end_changes(changes)
+        power_from = self.power_from[0] + self.power_from[1] * change_a + self.power_from[2] * change_b
+        power_to = self.power_to[0] + self.power_to[1] * change_a + self.power_to[2] * change_b
+        return power_from, power_to
+
+    def get_jacobian(self, sparse=False):
+        """ Derivative of the node powers from the straps (get_node_powers) with respect to the node temperature
+        changes over the linearised step, as a dense (..., n_nodes, n_nodes) array or a scipy.sparse matrix.
+        """
+        network = self.network
+        node_a, node_b = network.con_from[self.cons], network.con_to[self.cons]
+        rows = np.concatenate((node_a, node_a, node_b, node_b))
+        cols = np.concatenate((node_a, node_b, node_a, node_b))
+        values = np.concatenate((-self.power_from[1], -self.power_from[2], self.power_to[1], self.power_to[2]),
+                                axis=-1)
+        if sparse:
+            return scipy_sparse.coo_matrix((values, (rows, cols)), shape=(network.n_nodes, network.n_nodes))
+        jacobian = np.zeros(values.shape[:-1] + (network.n_nodes, network.n_nodes))
+        for i in range(0, len(rows)):               # Straps may share end nodes
+            jacobian[..., rows[i], cols[i]] += values[..., i]
+        return jacobian
+
+    def get_node_powers(self, power_from, power_to):
+        """ Net power (W) into the network nodes from the strap end flows. """
+        network = self.network
+        node_powers = network._scatter(network.con_to[self.cons], power_to)
+        node_powers -= network._scatter(network.con_from[self.cons], power_from)
+        return node_powers
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+import itertools
+import numpy as np
+from cooler import Cooler
+from integrator import Integrator
+from recorder import Recorder
+
+
+class Sweep:
+    """ Parameter sweep over variants of a compiled Network, advanced together as one batched computation on
+    (n_variants, n_nodes) temperature arrays.  The grids are a dictionary keyed by '<parameter>:<element>',
+
+        {'cooler:pt16_hp': ['pt16_st', 'pt30_hp'], 'area_length:det_link': [2.E-4, 4.E-4, 8.E-4]}
+
+    and every combination of the grid values is one variant (6 in this example).  The parameters are
+
+        'cooler'                - power curve (a column of coolers.csv) of the named cooler
+        'area_length'           - cross-section area / length (m) of the named conductor
+        'emissivity', 'area'    - emissivity and area (m2) of the named radiator
+        'mass', 'temperature'   - mass (kg) and initial temperature (K) of the named capacitor
+    """
+
+    parameters = {'cooler': ('cooler_ids', 'names'),
+                  'area_length': ('con_area_length', 'con_element_names'),
+                  'emissivity': ('rad_emissivity', 'rad_element_names'),
+                  'area': ('rad_area', 'rad_element_names'),
+                  'mass': ('masses', 'names'),
+                  'temperature': ('temperatures', 'names')}
+
+    def __init__(self, network, grids):
+        keys = list(grids.keys())
+        self.variants = [dict(zip(keys, values)) for values in itertools.product(*[grids[key] for key in keys])]
+        self.n_variants = len(self.variants)
+        fields = {}
+        for key in keys:
+            parameter, element = Sweep._parse_key(key)
+            field, name_field = Sweep.parameters[parameter]
+            index = Sweep._find_element(network, parameter, element, name_field)
+            if field not in fields:
+                fields[field] = np.tile(getattr(network, field), (self.n_variants, 1))
+            for i, variant in enumerate(self.variants):
+                value = variant[key]
+                if parameter == 'cooler':
+                    if value not in Cooler.table.ids:
+                        raise ValueError("Unknown cooler curve {:s}".format(str(value)))
+                    value = Cooler.table.get_id(value)
+                fields[field][i, index] = value
+        self.network = network.replace(**fields)
+        self.temperatures = None
+        return
+
+    @staticmethod
+    def _parse_key(key):
+        tokens = key.split(':')
+        if len(tokens) != 2 or tokens[0] not in Sweep.parameters:
+            raise ValueError("Sweep key {:s} is not '<parameter>:<element>' with parameter one of {:s}".format(
+                key, str(list(Sweep.parameters.keys()))))
+        return tokens[0], tokens[1]
+
+    @staticmethod
+    def _find_element(network, parameter, element, name_field):
+        """ Column of the network field array which holds the parameter of the named element. """
+        names = list(getattr(network, name_field))
+        if element not in names:
+            raise ValueError("No element {:s} in the model to sweep {:s}".format(element, parameter))
+        index = names.index(element)
+        if parameter == 'cooler':
+            cooler_nodes = list(network.cooler_nodes)
+            if index not in cooler_nodes:
+                raise ValueError("Capacitor {:s} is not a cooler".format(element))
+            index = cooler_nodes.index(index)
+        return index
+
+    def get_initial_temperatures(self):
+        shape = (self.n_variants, self.network.n_nodes)
+        return np.array(np.broadcast_to(self.network.temperatures, shape))
+
+    def run(self, run_time, delta_time, **kwargs):
+        """ Run all variants together for run_time seconds.  Returns a Recorder whose histories have shape
+        (n_samples, n_variants), variant i having the parameters in self.variants[i].  The final temperatures
+        are left in self.temperatures.  Other kwargs are passed to Integrator (dense backend only).
+
+        To fork every variant from a shared warm state, pass a checkpoint state (see Checkpoint.read) as
+        'resume', run_time then being the absolute end time.
+        """
+        record_interval = kwargs.pop('record_interval', 0.)     # Minimum time between recorded samples (s)
+        profiler = kwargs.pop('profiler', None)
+        resume = kwargs.pop('resume', None)
+        if resume is not None:
+            shape = (self.n_variants, self.network.n_nodes)
+            resume = dict(resume)
+            for name in ['temps', 'temps_prev']:
+                if resume[name] is not None:
+                    resume[name] = np.array(np.broadcast_to(resume[name], shape))
+            if resume.get('strap_temps', None) is not None:
+                strap_temps = resume['strap_temps']
+                resume['strap_temps'] = np.array(np.broadcast_to(strap_temps, (self.n_variants,) + strap_temps.shape))
+        network = self.network
+        n_samples = int(run_time / max(delta_time, record_interval)) + 1
+        recorder = Recorder(network.names, network.con_names, network.rad_names, interval=record_interval,
+                            n_samples=n_samples, n_variants=self.n_variants)
+        integrator = Integrator(network, **kwargs)
+        self.temperatures = integrator.run(self.get_initial_temperatures(), run_time, delta_time, recorder,
+                                           profiler=profiler, resume=resume)
+        return recorder
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+import numpy as np
+
+
+class Table:
+    """ Material property curves (capacity, integrated conductivity, cooler power) resampled once onto a
+    uniform temperature grid and held in one contiguous (n_materials, n_temps) array.  Looking up a value is
+    then O(1) index arithmetic rather than a binary search in np.interp.  The tabulated temperatures in
+    materials/*.csv are whole kelvin, so with the default 0.5 K grid the linear interpolation is unchanged.
+
+    The integral of each curve from t_min (eg the specific enthalpy from a heat capacity curve) and its inverse
+    are also available, exact for the piecewise linear curves, and are tabulated on first use.
+    """
+
+    def __init__(self, data, **kwargs):
+        temps = np.array(data['Temp'])
+        self.step = kwargs.get('step', 0.5)             # Grid spacing in K
+        self.t_min = float(np.min(temps))
+        n_temps = int(round((np.max(temps) - self.t_min) / self.step)) + 1
+        self.temps = self.t_min + self.step * np.arange(0, n_temps)
+        self.names = list(data.keys())[1:]
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        values = [np.interp(self.temps, temps, data[name]) for name in self.names]
+        self.values = np.ascontiguousarray(values, dtype=float)
+        self.flat = self.values.ravel()
+        self.rows = self.values.tolist()                 # Python floats for fast scalar lookups
+        self.n_temps = n_temps
+        self.integrals, self.integral_keys, self.integral_offset = None, None, None
+        return
+
+    @staticmethod
+    def from_values(names, t_min, step, values):
+        """ Rebuild a table from its resampled (n_materials, n_temps) values, eg a view onto shared memory,
+        without copying them or re-reading the csv files.
+        """
+        table = Table.__new__(Table)
+        table.t_min, table.step = t_min, step
+        table.n_temps = values.shape[1]
+        table.temps = t_min + step * np.arange(0, table.n_temps)
+        table.names = list(names)
+        table.ids = {name: i for i, name in enumerate(table.names)}
+        table.values = values
+        table.flat = values.ravel()
+        table.rows = values.tolist()
+        table.integrals, table.integral_keys, table.integral_offset = None, None, None
+        return table
+
+    def get_id(self, name):
+        return self.ids[name]
+
+    def lookup(self, material_id, temp):
+        """ Scalar lookup of the curve in row material_id at temperature temp. """
+        row = self.rows[material_id]
+        x = (temp - self.t_min) / self.step
+        if x <= 0.:
+            return row[0]
+        if x >= self.n_temps - 1:
+            return row[-1]
+        i = int(x)
+        v = row[i]
+        return v + (x - i) * (row[i+1] - v)
+
+    def _locate(self, material_ids, temps):
+        """ Fractional grid position of temps and flat index of the grid point below it in self.flat. """
+        x = (np.asarray(temps, dtype=float) - self.t_min) * (1. / self.step)
+        np.maximum(x, 0., out=x)
+        np.minimum(x, self.n_temps - 1., out=x)
+        i = x.astype(np.intp)
+        np.minimum(i, self.n_temps - 2, out=i)
+        x -= i
+        return x, i + np.asarray(material_ids) * self.n_temps
+
+    def evaluate(self, material_ids, temps):
+        """ Batched lookup of the curves in rows material_ids at temperatures temps, in a single call. """
+        frac, k = self._locate(material_ids, temps)
+        v = self.flat.take(k)
+        return v + frac * (self.flat.take(k + 1) - v)
+
+    def evaluate_slope(self, material_ids, temps):
+        """ Batched derivative of the curves with respect to temperature, zero outside the tabulated range. """
+        temps = np.asarray(temps, dtype=float)
+        frac, k = self._locate(material_ids, temps)
+        slopes = (self.flat.take(k + 1) - self.flat.take(k)) * (1. / self.step)
+        return np.where((temps < self.t_min) | (temps > self.temps[-1]), 0., slopes)
+
+    def _integrate(self):
+        """ Tabulate the integral of each curve at the grid points.  The rows are offset so that, for positive
+        curves, the flattened integrals increase monotonically and can be searched in a single call.
+        """
+        values = self.values
+        n_mat = values.shape[0]
+        cells = 0.5 * self.step * (values[:, :-1] + values[:, 1:])
+        self.integrals = np.concatenate((np.zeros((n_mat, 1)), np.cumsum(cells, axis=1)), axis=1)
+        self.integral_offset = float(np.max(self.integrals[:, -1])) + 1.
+        offsets = self.integral_offset * np.arange(0, n_mat)[:, np.newaxis]
+        self.integral_keys = (self.integrals + offsets).ravel()
+        return
+
+    def evaluate_integral(self, material_ids, temps):
+        """ Batched integral of the curves from t_min to temps.  The curves are constant outside the grid (see
+        evaluate) so the integral continues linearly there.
+        """
+        if self.integrals is None:
+            self._integrate()
+        temps = np.asarray(temps, dtype=float)
+        frac, k = self._locate(material_ids, temps)
+        v0, v1 = self.flat.take(k), self.flat.take(k + 1)
+        integrals = self.integrals.ravel().take(k) + self.step * frac * (v0 + 0.5 * frac * (v1 - v0))
+        integrals += np.minimum(temps - self.t_min, 0.) * v0 + np.maximum(temps - self.temps[-1], 0.) * v1
+        return integrals
+
+    def invert_integral(self, material_ids, integrals):
+        """ Batched inverse of evaluate_integral, the temperatures at which the integrals of the (positive)
+        curves in rows material_ids reach the values 'integrals'.
+        """
+        if self.integrals is None:
+            self._integrate()
+        ids = np.asarray(material_ids)
+        integrals = np.asarray(integrals, dtype=float)
+        n_temps = self.n_temps
+        first = ids * n_temps
+        k = np.searchsorted(self.integral_keys, integrals + ids * self.integral_offset, side='right') - 1
+        k = np.clip(k, first, first + n_temps - 2)
+        v0, v1 = self.flat.take(k), self.flat.take(k + 1)
+        dh = integrals - self.integrals.ravel().take(k)
+        a, b = 0.5 * self.step * (v1 - v0), self.step * v0      # Solve a x^2 + b x = dh for the cell fraction x
+        x = 2. * dh / np.maximum(b + np.sqrt(np.maximum(b * b + 4. * a * dh, 0.)), 1.0E-300)
+        temps = self.t_min + self.step * (k - first + x)
+        end = self.integrals[ids, -1]
+        temps = np.where(integrals < 0., self.t_min + integrals / self.flat.take(first), temps)
+        temps = np.where(integrals > end, self.temps[-1] + (integrals - end) / self.flat.take(first + n_temps - 1),
+                         temps)
+        return temps
@@ -1,110 +1,294 @@
 #!/usr/bin/python
 import math
+import logging
 import numpy as np
-from matplotlib.patches import FancyArrowPatch
 from plot import Plot
-from conductor import Conductor
 from capacitor import Capacitor
-from radiator import Radiator
-from cooler import Cooler
+from network import Network
+from integrator import Integrator
+from recorder import Recorder
+from loader import Loader
+from checkpoint import Checkpoint
+from reduction import Reduction
+
+log = logging.getLogger(__name__)
 
 
 class Thermal:
 
     capacity, conductivity = None, None
-    capacitors, conductors, radiators, heaters = [], [], [], []
     output = None
+    boundary_mass = 1000.       # Capacitors at least this heavy (kg) are treated as fixed temperature reservoirs
 
     def __init__(self):
+        self.capacitors, self.conductors, self.radiators = [], [], []     # Each Thermal holds its own model
+        self.enclosures = []
+        self.stop_time, self.stop_condition = None, None        # Set when a run is ended by a StopCondition
+        self.model_names = []
+        self.network, self.network_elements = None, None       # Compiled model, see get_network
         return
 
-    @staticmethod
-    def load_model(model_name):
+    def load_model(self, model_name, **kwargs):
+        profiler = kwargs.get('profiler', None)     # Optional Profiler, times the 'load_model' and 'plot' phases
+        plot = kwargs.get('plot', True)             # Set False to run headless, without importing matplotlib
 
         path = './data/' + model_name + '.csv'
-        print('Loading model ' + path)
-        with open(path, 'r') as text_file:
-            records = text_file.read().splitlines()
-            for record in records:
-                print(record)
-                tokens = tuple([t.strip() for t in record.split(',')])
-                if len(tokens) < 1:
-                    continue
-                tok0 = tokens[0]
-                if '#' in tok0:
-                    continue
-                if 'cap' in tok0:
-                    capacitor = Capacitor(tokens[1:6])
-                    Thermal.capacitors.append(capacitor)
-                if 'coo' in tok0:
-                    cooler = Cooler(tokens[1:6])
-                    Thermal.capacitors.append(cooler)
-                if 'con' in tok0:
-                    cap_names = tokens[5].split(';')
-                    caps = []
-                    for cap_name in cap_names:
-                        for cap in Thermal.capacitors:
-                            if cap.name in cap_name:
-                                caps.append(cap)
-                                break
-                    conductor = Conductor(tokens[1:6], caps)
-                    Thermal.conductors.append(conductor)
-                if 'rad' in tok0:
-                    cap_names = tokens[5].split(';')
-                    caps = []
-                    for cap_name in cap_names:
-                        for cap in Thermal.capacitors:
-                            if cap.name in cap_name:
-                                caps.append(cap)
-                                break
-                    radiator = Radiator(tokens[1:5], caps)
-                    Thermal.radiators.append(radiator)
+        log.info('Loading model ' + path)
+        if profiler is None:
+            capacitors, conductors, radiators, enclosures = Loader.read_model(model_name)
+        else:
+            capacitors, conductors, radiators, enclosures = profiler.timed('load_model', Loader.read_model,
+                                                                           model_name)
+        self.capacitors += capacitors
+        self.conductors += conductors
+        self.radiators += radiators
+        self.enclosures += enclosures
+        self.model_names.append(model_name)
+        if len(self.model_names) == 1 and len(self.capacitors) == len(capacitors):
+            self.network = Loader.load_network(model_name, (capacitors, conductors, radiators, enclosures))
+            self.network_elements = self._get_element_ids()
 
         plot_data = False
         if plot_data:
             Capacitor.plot_data(group='Marvel')
-        plot_model = True
+        plot_model = plot
         if plot_model:
-            Thermal.plot_model()
+            if profiler is None:
+                self.plot_model()
+            else:
+                profiler.timed('plot', self.plot_model)
         return
 
-    @staticmethod
-    def run():
-        delta_time = 1.                         # Model tick in seconds
-        run_time = 1*3600.                      # Run for n seconds
-        capacitors = Thermal.capacitors
-        conductors = Thermal.conductors
-        radiators = Thermal.radiators
-        n_caps = len(capacitors)
+    def run(self, **kwargs):
+        mode = kwargs.get('mode', 'object')    # 'object' loops over elements, 'network' uses the compiled arrays
+        delta_time = kwargs.get('delta_time', 1.)       # Model tick (initial tick if adaptive) in seconds
+        run_time = kwargs.get('run_time', 1*3600.)      # Run for n seconds
+        record_interval = kwargs.get('record_interval', 0.)     # Minimum time between recorded samples (s)
+        record_tolerance = kwargs.get('record_tolerance', None)  # Only record after a change of this many K
+        sink = kwargs.get('sink', None)         # Optional MemmapSink or Hdf5Sink to stream the results to disk
+        profiler = kwargs.get('profiler', None)     # Optional Profiler to time the phases of the run
+        plot = kwargs.get('plot', True)             # Set False to run headless, without importing matplotlib
+        stop = kwargs.get('stop', [])               # StopConditions (see stop.py) which end the run early
+        checkpoint = kwargs.get('checkpoint', None)     # Checkpoint file written during the run (network mode)
+        checkpoint_interval = kwargs.get('checkpoint_interval', 3600.)     # Simulated seconds between checkpoints
+        resume = kwargs.get('resume', None)         # Checkpoint file to continue from, run_time is then absolute
+        fork = kwargs.get('fork', False)            # Continue from the checkpoint with a changed model
+        cache = kwargs.get('cache', None)           # Optional ResultCache holding the results of earlier runs
+        reduce = kwargs.get('reduce', None)         # Merge nodes relaxing faster than reduce * delta_time
+        if reduce is not None:
+            return self.run_reduced(**kwargs)
+        capacitors = self.capacitors
+        conductors = self.conductors
+        radiators = self.radiators
+        if mode != 'network' and (checkpoint is not None or resume is not None):
+            raise ValueError("Checkpoint and resume need mode='network'")
+        state = None if resume is None else Checkpoint.read(resume)
+        start = state['position'] if state is not None and sink is not None and not fork else 0
+
+        n_samples = int(run_time / max(delta_time, record_interval)) + 1
+        recorder = Recorder([cap.name for cap in capacitors],
+                            [con.from_to_name for con in conductors],
+                            [rad.from_to_name for rad in radiators],
+                            interval=record_interval, tolerance=record_tolerance, n_samples=n_samples, sink=sink,
+                            start=start)
+        integrator = kwargs.get('integrator', 'euler')      # See Integrator.methods (network mode)
+        adaptive = kwargs.get('adaptive', False)
+        backend = kwargs.get('backend', 'dense')            # 'sparse' for networks with thousands of nodes
+        enthalpy = kwargs.get('enthalpy', False)            # Exact enthalpy based node update, for large ticks
+
+        key, cached = None, None
+        if cache is not None and sink is None and checkpoint is None and resume is None:
+            settings = {'mode': mode, 'run_time': run_time, 'delta_time': delta_time,
+                        'record_interval': record_interval, 'record_tolerance': record_tolerance,
+                        'stop': [[type(condition).__name__, {name: value for name, value in vars(condition).items()
+                                                              if name not in ['node', 'nodes']}] for condition in stop]}
+            if mode == 'network':
+                settings.update({'integrator': integrator, 'adaptive': adaptive, 'backend': backend,
+                                 'enthalpy': enthalpy})
+            network = self.get_network()
+            key = cache.get_key([Loader.get_key(name) for name in self.model_names], Checkpoint.get_key(network),
+                                network.temperatures.tolist(), settings)
+            cached = cache.get(key)
+        if cached is not None:
+            self.restore_results(cached, recorder, stop)
+        elif mode == 'network':
+            if checkpoint is not None:
+                checkpoint = Checkpoint(checkpoint, interval=checkpoint_interval)
+            self.run_network(run_time, delta_time, recorder, method=integrator, adaptive=adaptive,
+                             backend=backend, enthalpy=enthalpy, profiler=profiler, stop=stop,
+                             checkpoint=checkpoint, resume=state, fork=fork)
+        else:
+            self.run_objects(run_time, delta_time, recorder, profiler=profiler, stop=stop)
+        if key is not None and cached is None:
+            self.store_results(cache, key, recorder, stop)
+        if self.stop_condition is not None:
+            log.info("Run stopped at {:.1f} s, {:s}".format(self.stop_time, str(self.stop_condition)))
+
+        if not plot:
+            recorder.close()
+            return recorder
+        times, temp_series, con_series, rad_series = recorder.get_series()
+        plot_args = capacitors, conductors, radiators, times, temp_series, con_series, rad_series
+        if profiler is None:
+            Thermal.plot_profiles(*plot_args)
+        else:
+            profiler.timed('plot', Thermal.plot_profiles, *plot_args)
+        return recorder
+
+    def store_results(self, cache, key, recorder, stop):
+        arrays = recorder.get_arrays()
+        arrays['final_temps'] = np.array([cap.temperature for cap in self.capacitors])
+        stop_index = -1 if self.stop_condition is None else stop.index(self.stop_condition)
+        arrays['stop'] = np.array([stop_index, np.nan if self.stop_time is None else self.stop_time])
+        cache.put(key, arrays)
+        return
 
-        temp_series, con_series, rad_series = {}, {}, {}
-        for cap in capacitors:
-            temp_series[cap.name] = []
-        for con in conductors:
-            con_series[con.from_to_name] = []
-        for rad in radiators:
-            rad_series[rad.from_to_name] = []
+    def restore_results(self, arrays, recorder, stop):
+        """ Fill the recorder and set the capacitor temperatures from a cached run. """
+        recorder.set_arrays(arrays)
+        for capacitor, temp in zip(self.capacitors, arrays['final_temps']):
+            capacitor.temperature = float(temp)
+        stop_index, stop_time = int(arrays['stop'][0]), float(arrays['stop'][1])
+        self.stop_condition = None if stop_index < 0 else stop[stop_index]
+        self.stop_time = None if stop_index < 0 else stop_time
+        return
+
+    def run_reduced(self, **kwargs):
+        """ Run a reduced order copy of the model (see reduction.py), in which capacitors joined so stiffly that
+        they relax within reduce * delta_time, and whose steady state temperatures differ by less than
+        reduce_drop kelvin, are lumped together, then set the temperatures of the original capacitors from their
+        super-nodes.  Unless expand=False (or the results are streamed to a sink) the returned Recorder holds the
+        temperature history of every original capacitor.
+        """
+        kwargs = dict(kwargs)
+        reduce = kwargs.pop('reduce')
+        expand = kwargs.pop('expand', True)         # Map the recorded temperatures back onto the original nodes
+        max_drop = kwargs.pop('reduce_drop', 0.1)   # Largest steady state drop (K) across a merged conductor
+        plot = kwargs.pop('plot', True)
+        stop = kwargs.get('stop', [])
+        keep = [condition.name for condition in stop if hasattr(condition, 'name')]
+        keep += [name for condition in stop for name in getattr(condition, 'ignore', [])]
+        reduction = Reduction(self.capacitors, self.conductors, self.radiators, self.enclosures,
+                              kwargs.get('delta_time', 1.), ratio=reduce, keep=keep, max_drop=max_drop,
+                              boundary_mass=Thermal.boundary_mass)
+        log.info("Reduced model from {:d} to {:d} capacitors".format(len(self.capacitors),
+                                                                    len(reduction.capacitors)))
+        reduced = Thermal()
+        reduced.capacitors, reduced.conductors, reduced.radiators, reduced.enclosures = reduction.get_model()
+        reduced.model_names = self.model_names
+        recorder = reduced.run(plot=False, **kwargs)
+        reduction.apply()
+        self.stop_time, self.stop_condition = reduced.stop_time, reduced.stop_condition
+        capacitors = reduced.capacitors
+        if expand and kwargs.get('sink', None) is None:
+            recorder = reduction.expand_recorder(recorder)
+            capacitors = self.capacitors
+        if plot:
+            times, temp_series, con_series, rad_series = recorder.get_series()
+            Thermal.plot_profiles(capacitors, reduced.conductors, reduced.radiators, times, temp_series, con_series,
+                                  rad_series)
+        return recorder
+
+    def get_network(self):
+        """ Compiled Network of the model at the current capacitor temperatures, eg to build a Sweep.  A model
+        loaded from a single file uses the network cached by Loader.load_network, and any other is compiled once
+        and then reused until elements are added to or removed from the model.  Recompile after changing the
+        properties of an element by setting self.network = None.
+        """
+        if self.network is None or self.network_elements != self._get_element_ids():
+            self.network = Network(self.capacitors, self.conductors, self.radiators, self.enclosures)
+            self.network_elements = self._get_element_ids()
+        temps = np.array([cap.temperature for cap in self.capacitors])
+        return self.network.replace(temperatures=temps)
+
+    def _get_element_ids(self):
+        return [[id(element) for element in elements]
+                for elements in [self.capacitors, self.conductors, self.radiators, self.enclosures]]
+
+    def solve_steady_state(self, **kwargs):
+        """ Find the equilibrium temperature of every capacitor directly, without running the transient.
+        Conduction, radiation and cooler load are balanced at every node except the boundary nodes, which are
+        held at their current temperature.  'boundary' is a list of capacitor names and defaults to all
+        capacitors heavier than Thermal.boundary_mass.  Returns a dictionary of temperatures keyed by name.
+        """
+        network = self.get_network()
+        boundary = kwargs.get('boundary', None)
+        if boundary is None:
+            fixed = network.masses >= Thermal.boundary_mass
+        else:
+            fixed = np.array([name in boundary for name in network.names])
+        temps = network.find_steady_state(network.temperatures, fixed, **kwargs)
+        return {name: float(temp) for name, temp in zip(network.names, temps)}
 
+    def run_objects(self, run_time, delta_time, recorder, profiler=None, stop=None):
+        capacitors = self.capacitors
+        conductors = self.conductors
+        radiators = self.radiators
+        meshed = [con.name for con in conductors if con.segments > 1]
+        if len(meshed) > 0:         # Conductor.transfer_heat has no heat capacity, see strap.py
+            raise ValueError("Meshed conductors {:s} need mode='network'".format(', '.join(meshed)))
+
+        self.stop_time, self.stop_condition = None, None
+        stop = [] if stop is None else stop
+        for condition in stop:
+            condition.bind([cap.name for cap in capacitors])
+        con_powers, rad_powers = np.zeros(len(conductors)), np.zeros(len(radiators))
+        temps = np.array([cap.temperature for cap in capacitors])
+        node_powers = np.zeros(len(capacitors))
+        n_interps = 2 * len(conductors) + len(capacitors) + len([cap for cap in capacitors if cap.is_cooler])
         times = np.arange(0., run_time, delta_time)
+        if profiler is not None:
+            profiler.start()
         for time in times:
-            for conductor in conductors:        # Calculate heat flows into all capacitors through connectors
-                power, cap_a, cap_b = conductor.transfer_heat(time)
-                name = cap_a.name + '->' + cap_b.name
-                con_series[name].append(power)  # Heat flow from A to B
-            for radiator in radiators:        # Calculate heat flows into all capacitors through connectors
-                power, cap_a, cap_b = radiator.transfer_heat(time)
-                name = cap_a.name + '->' + cap_b.name
-                rad_series[name].append(power)  # Heat flow from A to B
-            for capacitor in capacitors:        # Find new temperatures of all capacitors (and reset heat flows)
-                print(capacitor.name)
-                capacitor.find_new_temperature(time, delta_time)
-                temp_series[capacitor.name].append(capacitor.temperature)
-
-        Thermal.plot_profiles(capacitors, conductors, radiators, times, temp_series, con_series, rad_series)
+            for i, conductor in enumerate(conductors):    # Calculate heat flows into all capacitors through connectors
+                con_powers[i], _, _ = conductor.transfer_heat(time)     # Heat flow from A to B
+            if profiler is not None:
+                profiler.lap('conduction')
+            for i, radiator in enumerate(radiators):      # Calculate heat flows into all capacitors through connectors
+                rad_powers[i], _, _ = radiator.transfer_heat(time)      # Heat flow from A to B
+            for enclosure in self.enclosures:
+                enclosure.transfer_heat(time)
+            if profiler is not None:
+                profiler.lap('radiation')
+            old_temps = temps.copy()
+            for i, capacitor in enumerate(capacitors):    # Find new temperatures (and reset heat flows)
+                node_powers[i] = capacitor.find_new_temperature(time, delta_time)
+                temps[i] = capacitor.temperature
+            if profiler is not None:
+                profiler.lap('capacitors')
+            recorder.record(time, temps, con_powers, rad_powers)
+            if profiler is not None:
+                profiler.lap('record')
+                profiler.end_tick(time, n_interps)
+            for condition in stop:
+                stop_time = condition.check(time, delta_time, old_temps, temps, node_powers)
+                if stop_time is not None:
+                    self.stop_time, self.stop_condition = stop_time, condition
+                    return
         return
 
-    @staticmethod
-    def plot_model():
+    def run_network(self, run_time, delta_time, recorder, **kwargs):
+        """ Run the model using the compiled struct-of-arrays network.  With the default explicit Euler
+        integrator this gives the same results as run_objects.  A checkpoint state to resume from must have
+        been written from the same model, unless fork=True.  Other kwargs are passed to Integrator.
+        """
+        network = self.get_network()
+        profiler = kwargs.pop('profiler', None)
+        stop = kwargs.pop('stop', None)
+        checkpoint = kwargs.pop('checkpoint', None)
+        resume = kwargs.pop('resume', None)
+        fork = kwargs.pop('fork', False)
+        if resume is not None and not fork and resume['key'] != Checkpoint.get_key(network):
+            raise ValueError("The checkpoint was written from a different model, use fork=True to continue it")
+        integrator = Integrator(network, **kwargs)
+        temps = integrator.run(network.temperatures, run_time, delta_time, recorder, profiler=profiler, stop=stop,
+                               checkpoint=checkpoint, resume=resume, fork=fork)
+        network.apply(temps, self.capacitors)
+        self.stop_time, self.stop_condition = integrator.stop_time, integrator.stop_condition
+        return
+
+    def plot_model(self):
+        from matplotlib.patches import FancyArrowPatch
         plot = Plot()
         _, axs = plot.set_plot_area('Model elements', aspect='equal')
         ax = axs[0, 0]
@@ -115,7 +299,7 @@ class Thermal:
         w, h = 0.25, 0.25
         theta = 0.
         radius = .8
-        capacitors = Thermal.capacitors
+        capacitors = self.capacitors
         n_elements = len(capacitors)
         dtheta = 2. * math.pi / n_elements
         for capacitor in capacitors:
@@ -128,7 +312,7 @@ class Thermal:
             ax.text(xc, yc, text,
                     fontsize=10, color=color, backgroundcolor='lightgrey',
                     va='center', ha='center')
-        for conductor in Thermal.conductors:
+        for conductor in self.conductors:
             cap1, cap2 = conductor.capacitors[0], conductor.capacitors[1]
             pos1, pos2 = cap1.position, cap2.position
             xc, yc = 0.5 * (pos1[0] + pos2[0]), 0.5 * (pos1[1] + pos2[1]) - 0.09
@@ -139,7 +323,7 @@ class Thermal:
                     fontsize=10, color='black', backgroundcolor='white',
                     va='center', ha='center'
                     )
-        for radiator in Thermal.radiators:
+        for radiator in self.radiators:
             pos1, pos2 = radiator.capacitors[0].position, radiator.capacitors[1].position
             xc, yc = 0.5 * (pos1[0] + pos2[0]), 0.5 * (pos1[1] + pos2[1]) + 0.09
             arrow = FancyArrowPatch(pos1, pos2)
@@ -156,7 +340,7 @@ class Thermal:
 
         _, axs = plot.set_plot_area('Temperature v time')
         n_caps = len(capacitors)
-        colors = plot._make_colours(n_caps)
+        colors = plot._make_colours(max(n_caps, len(conductors)))     # Conductors take them by position
         ax = axs[0, 0]
         times_hr = times / 3600.
         ax.set_xlabel('Time / hr')
@@ -177,11 +361,11 @@ class Thermal:
         ax.set_xlabel('Time / hr')
         ax.set_ylabel('Power / watt')
 
-        for key, conductor in zip(con_series, conductors):
+        for i, (key, conductor) in enumerate(zip(con_series, conductors)):
             tag = tags[0]
             label = "{:s} {:s}".format(conductor.from_to_name, tag)
             power_watt = con_series[key]
-            color = colors[conductor.index]
+            color = colors[i]
             ax.plot(times, power_watt, ls=ls_list[0], label=label, color=color)
         for key, radiator in zip(rad_series, radiators):
             tag = tags[1]